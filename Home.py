@@ -2,53 +2,35 @@ import streamlit as st
 import pandas as pd
 import numpy as np
 import plotly.graph_objects as go
-import matplotlib.pyplot as plt
-import gspread
-from google.oauth2.service_account import Credentials
+from dataclasses import replace
+from brush_sheet import (
+    SHEET_ID, get_layout, get_revision, get_spreadsheet, get_worksheet_index, load_rounds, load_workbook_data,
+    load_config, load_round_values, record_saved_round, save_config, invalidate_revision, invalidate_worksheet_index)
+from brush_store import load_history
+from brush_calc import (
+    CLIP_NAN, REPLACEMENT_JUMP_MM, forecast_remaining, format_sheet_date, last_rate_stabilization, nan_separated, project_lengths,
+    projection_horizon)
+from brush_models import (
+    ESTIMATOR_LEAST_SQUARES, ESTIMATORS, MC_SAMPLES, ROBUST_ESTIMATORS, least_squares_trend, remaining_life_bands,
+    forecast_stage, rate_stage, robust_stage, stabilized_rates, unit_estimator)
+from brush_charts import avg_rate_figure, rate_table_html, remaining_hours_figure, remaining_hours_png
+from fleet import evaluate_fleet, fleet_units
 
 
 
-permanent_fixed_upper = {}
-permanent_fixed_lower = {}
-permanent_yellow_upper = {}
-permanent_yellow_lower = {}
-
-permanent_lock_upper = set()
-permanent_lock_lower = set()
-
-permanent_fixed_upper = st.session_state.get("permanent_fixed_upper", {})
-permanent_yellow_upper = st.session_state.get("permanent_yellow_upper", {})
-
 st.set_page_config(page_title="Brush Dashboard", layout="wide")
 
 page = st.sidebar.radio("📂 เลือกหน้า", [
     "📊 หน้าแสดงผล rate และ ชั่วโมงที่เหลือ",
     "📝 กรอกข้อมูลแปลงถ่านเพิ่มเติม",
-    "📈 พล็อตกราฟตามเวลา (แยก Upper และ Lower)"])
+    "📈 พล็อตกราฟตามเวลา (แยก Upper และ Lower)",
+    "🏭 ภาพรวมทุกเครื่อง (Fleet)"])
 
 
-def load_config_from_sheet(sh, sheet_name):
+def save_config_to_sheet(sh, old_config, new_config, layout):
+    # เขียนเฉพาะค่าที่เปลี่ยน (batch update ครั้งเดียว)
     try:
-        ws = sh.worksheet(sheet_name)
-        sheet_count = int(ws.acell("B41").value)
-        min_required = int(ws.acell("B42").value)
-        threshold_percent = float(ws.acell("B43").value)
-        alert_threshold_hours = int(ws.acell("B44").value)
-        length_threshold = float(ws.acell("B45").value)
-        return sheet_count, min_required, threshold_percent, alert_threshold_hours,length_threshold
-    except:
-        return 7, 5, 5.0, 50  # fallback default
-
-
-def save_config_to_sheet(sh, sheet_name, sheet_count, min_required, threshold_percent, alert_threshold_hours,length_threshold):
-    try:
-        ws = sh.worksheet(sheet_name)
-        ws.update("B41", [[sheet_count]])
-        ws.update("B42", [[min_required]])
-        ws.update("B43", [[threshold_percent]])
-        ws.update("B44", [[alert_threshold_hours]])
-        ws.update("B45", [[length_threshold]])
-
+        save_config(sh, old_config, new_config, layout)
     except Exception as e:
         st.error(f"❌ ไม่สามารถบันทึก config ลงชีตได้: {e}")
 
@@ -61,25 +43,24 @@ if page == "📊 หน้าแสดงผล rate และ ชั่วโ
     
    
 
-    # Setup credentials and spreadsheet access
-    service_account_info = st.secrets["gcp_service_account"]
-    creds = Credentials.from_service_account_info(service_account_info, scopes=["https://www.googleapis.com/auth/spreadsheets"])
-    gc = gspread.authorize(creds)
-    sheet_url = "https://docs.google.com/spreadsheets/d/1Pd6ISon7-7n7w22gPs4S3I9N7k-6uODdyiTvsfXaSqY/edit?usp=sharing"
+    # Setup credentials and spreadsheet access (client + handle ใช้ร่วมกันทุก session)
     try:
-        sh = gc.open_by_url(sheet_url)
+        sh = get_spreadsheet(SHEET_ID)
     except Exception as e:
         st.error(f"❌ ไม่สามารถเปิด Google Sheet ได้: {e}")
         st.stop()  # หยุดการทำงานหน้าเว็บเพื่อไม่ให้พังต่อ
 
     
-    # โหลดค่าจาก Google Sheet (B41-B44)
-    sheet_count, min_required, threshold_percent, alert_threshold_hours,length_threshold = load_config_from_sheet(sh, "Sheet1")
+    # โหลดค่าจาก Google Sheet (B41-B45) มาพร้อมข้อมูลรอบ ไม่ต้องเรียก API เพิ่ม
+    config = load_config(SHEET_ID)
+    layout = get_layout(SHEET_ID)  # จำนวนแปรง/ตำแหน่งคอลัมน์ของเครื่องนี้
+    sheet_count = config.sheet_count
+    min_required = config.min_required
+    threshold_percent = config.threshold_percent
+    alert_threshold_hours = config.alert_threshold_hours
+    length_threshold = config.length_threshold
 
-    sheet_names = [ws.title for ws in sh.worksheets()]
-    if "Sheet1" in sheet_names:
-        sheet_names.remove("Sheet1")
-        sheet_names = ["Sheet1"] + sheet_names
+    sheet_names = get_worksheet_index(SHEET_ID).sheet1_first  # Sheet1 อยู่บนสุด
 
     sheet_count = st.number_input("📌 เลือกจำนวน Sheet ที่ต้องใช้", min_value=1, max_value=len(sheet_names), value=sheet_count)
 
@@ -88,53 +69,16 @@ if page == "📊 หน้าแสดงผล rate และ ชั่วโ
 
 
     import requests
-    from io import BytesIO
-
-    sheet_id = "1Pd6ISon7-7n7w22gPs4S3I9N7k-6uODdyiTvsfXaSqY"
-    sheet_url_export = f"https://docs.google.com/spreadsheets/d/{sheet_id}/export?format=xlsx"
 
-    response = requests.get(sheet_url_export)
-    xls = pd.ExcelFile(BytesIO(response.content), engine="openpyxl")
+    # 📦 ใช้ไฟล์ xlsx ที่ cache ไว้ตาม revision ของชีต (ดาวน์โหลดและอ่านครั้งเดียวต่อ revision)
+    rounds = load_rounds(SHEET_ID)
 
 
 
-    brush_numbers = list(range(1, 33))
-    upper_rates, lower_rates = {n:{} for n in brush_numbers}, {n:{} for n in brush_numbers}
-    rate_fixed_upper = set()
-    rate_fixed_lower = set()
-    yellow_mark_upper = {}
-    yellow_mark_lower = {}
-
-    # Step 1: Calculate rates per sheet
-    for sheet in selected_sheets:
-        df_raw = xls.parse(sheet, header=None)
-        try:
-            hours = float(df_raw.iloc[0, 7])
-        except:
-            continue
-        df = xls.parse(sheet, skiprows=2, header=None)
-
-        lower_df = df.iloc[:, 0:3]
-        lower_df.columns = ["No_Lower", "Lower_Previous", "Lower_Current"]
-        lower_df = lower_df.apply(pd.to_numeric, errors='coerce').dropna()
-
-        upper_df = df.iloc[:, 4:6]
-        upper_df.columns = ["Upper_Current", "Upper_Previous"]
-        upper_df = upper_df.apply(pd.to_numeric, errors='coerce').dropna()
-        upper_df["No_Upper"] = range(1, len(upper_df) + 1)
-
-        for n in brush_numbers:
-            u_row = upper_df[upper_df["No_Upper"] == n]
-            if not u_row.empty:
-                diff = u_row.iloc[0]["Upper_Current"] - u_row.iloc[0]["Upper_Previous"]
-                rate = diff / hours if hours > 0 else 0
-                upper_rates[n][f"Upper_{sheet}"] = rate if rate > 0 else 0
-
-            l_row = lower_df[lower_df["No_Lower"] == n]
-            if not l_row.empty:
-                diff = l_row.iloc[0]["Lower_Previous"] - l_row.iloc[0]["Lower_Current"]
-                rate = diff / hours if hours > 0 else 0
-                lower_rates[n][f"Lower_{sheet}"] = rate if rate > 0 else 0
+    brush_numbers = list(range(1, layout.brush_count + 1))
+    # Step 1: Calculate rates per sheet (ขั้น rate: cache ตาม revision + ชีตที่เลือก ไม่คำนวณใหม่เมื่อแก้ widget อื่น)
+    rates = rate_stage(SHEET_ID, selected_sheets)
+    upper_rates, lower_rates = rates.frame("Upper"), rates.frame("Lower")
 
 
  
@@ -171,110 +115,36 @@ if page == "📊 หน้าแสดงผล rate และ ชั่วโ
         return round(final_avg, 6), False
 
 
-    # 3. แก้ calc_avg_with_flag ให้ใช้ permanent_* ให้ค่าคงที่ตลอด
-
-    # เก็บค่าคงที่เดิมไว้ก่อน เพื่อไม่ให้รีเซ็ตทุกครั้ง
-    if "permanent_fixed_upper" not in st.session_state:
-        st.session_state.permanent_fixed_upper = {}
-    if "permanent_yellow_upper" not in st.session_state:
-        st.session_state.permanent_yellow_upper = {}
-    if "permanent_fixed_lower" not in st.session_state:
-        st.session_state.permanent_fixed_lower = {}
-    if "permanent_yellow_lower" not in st.session_state:
-        st.session_state.permanent_yellow_lower = {}
-
-    
-    sheet_index_map = {name: idx + 1 for idx, name in enumerate(selected_sheets)}
-    
-    # กำหนด จำนวนรอบที่ทำให้ rate คงที่ และ เปอร์เซ็นไม่เกินเท่าไร
-
-
-    def calc_avg_with_flag(
-        rates_dict, rate_fixed_set, mark_dict, permanent_fixed_rates,
-        permanent_yellow_dict, sheet_index_map, min_required , threshold):
-        df = pd.DataFrame.from_dict(rates_dict, orient='index')
-        df = df.reindex(range(1, 33)).fillna(0)
-        avg_col = []
-
-        for i, row in df.iterrows():
-            if i in permanent_fixed_rates:
-                avg_col.append(permanent_fixed_rates[i])
-                mark_dict[i] = permanent_yellow_dict.get(i, "")
-                continue
-
-            sheet_names = list(row[row > 0].index)
-            values = row[row > 0].tolist()
-
-            if len(values) >= min_required:
-                for j in range(min_required, len(values) + 1):
-                    prev = values[:j - 1]
-                    new = values[j - 1]
-                    sheet_name = sheet_names[j - 1]
-                    avg = sum(prev) / len(prev) if prev else 0
-                    percent_diff = abs(new - avg) / avg if avg > 0 else 1
-
-                    if percent_diff <= threshold:
-                        final_avg = round(avg, 6)
-                        avg_col.append(final_avg)
-                        rate_fixed_set.add(i)
-                        permanent_fixed_rates[i] = final_avg
-                        permanent_yellow_dict[i] = sheet_name
-                        break
-                else:
-                    avg_col.append(round(sum(values) / len(values), 6))
+    # 🟩 rate คงที่ของชุดรอบ + ค่าตั้งนี้ คำนวณครั้งเดียวต่อข้อมูลที่เปลี่ยน แล้วเก็บถาวรใน SQLite
+    # (ทุก session และหลัง restart ได้ผลเดียวกัน ไม่ขึ้นกับลำดับการกด widget)
+    stabilized = stabilized_rates(SHEET_ID, selected_sheets, min_required, threshold)
+    permanent_fixed_upper, permanent_fixed_lower = stabilized.fixed["Upper"], stabilized.fixed["Lower"]
+    permanent_yellow_upper, permanent_yellow_lower = stabilized.yellow["Upper"], stabilized.yellow["Lower"]
 
-            else:
-                avg_col.append(round(sum(values) / len(values), 6) if values else 0.000000)
+    upper_df, upper_avg = upper_rates.fillna(0), list(stabilized.avg["Upper"])
+    lower_df, lower_avg = lower_rates.fillna(0), list(stabilized.avg["Lower"])
 
-        return df, avg_col
 
 
+    # 📐 วิธีประมาณ rate ที่ใช้ในกราฟ ชั่วโมงที่เหลือ และการแจ้งเตือน (ค่าเริ่มต้นตามเครื่อง จาก secrets rate_estimators)
+    estimator_keys = list(ESTIMATORS)
+    estimator = st.radio("📐 วิธีประมาณ Avg Rate", estimator_keys, format_func=ESTIMATORS.get, horizontal=True,
+                         index=estimator_keys.index(unit_estimator(SHEET_ID)), key=f"estimator_{SHEET_ID}")
 
-    
- 
-
-    # 4. เรียกใช้แบบใหม่ (ตัวอย่าง Upper)
-
-    upper_df, upper_avg = calc_avg_with_flag(
-    upper_rates, rate_fixed_upper, yellow_mark_upper,
-    permanent_fixed_upper, permanent_yellow_upper,sheet_index_map,min_required, threshold)
-
-    lower_df, lower_avg = calc_avg_with_flag(
-        lower_rates, rate_fixed_lower, yellow_mark_lower,
-        permanent_fixed_lower, permanent_yellow_lower,sheet_index_map,min_required, threshold)
-    
-
-    st.session_state.permanent_fixed_upper = permanent_fixed_upper
-    st.session_state.permanent_yellow_upper = permanent_yellow_upper
-    st.session_state.permanent_fixed_lower = permanent_fixed_lower
-    st.session_state.permanent_yellow_lower = permanent_yellow_lower
-
-    
- 
-
+    rejected_upper = rejected_lower = None
+    if estimator in ROBUST_ESTIMATORS:
+        # 🛡️ คิดจากตาราง rate เดียวกัน ทุกแปรงพร้อมกัน และจำว่ารอบไหนถูกตัดออก (mask แปรง × รอบ)
+        robust = robust_stage(SHEET_ID, selected_sheets, estimator)
+        robust_upper, robust_lower = robust["Upper"], robust["Lower"]
+        rejected_upper, rejected_lower = robust_upper.rejected, robust_lower.rejected
 
     upper_df["Avg Rate (Upper)"] = upper_avg
     lower_df["Avg Rate (Lower)"] = lower_avg
+    if estimator in ROBUST_ESTIMATORS:
+        upper_df["Robust Rate (Upper)"] = robust_upper.avg
+        lower_df["Robust Rate (Lower)"] = robust_lower.avg
 
-    # Step 3: Styling output
-    def highlight_fixed_rate_row(row, column_name, permanent_fixed_rates, yellow_mark_dict):
-        styles = []
-        for col in row.index:
-            if col == column_name:
-                if row.name in permanent_fixed_rates:
-                    correct_fixed_value = permanent_fixed_rates[row.name]
-                    if abs(row[col] - correct_fixed_value) < 1e-6:
-                        styles.append("background-color: green; color: black; font-weight: bold")
-                    else:
-                        styles.append("color: red; font-weight: bold")
-                else:
-                    styles.append("color: red; font-weight: bold")
-            elif yellow_mark_dict.get(row.name, "") == col:
-                styles.append("color: yellow; font-weight: bold")
-            else:
-                styles.append("")
-        return styles
-    
+    # Step 3: Styling output (สีทั้งตารางจาก mask ครั้งเดียว แล้ว cache HTML ตามข้อมูล)
     round_show = min_required
     percent_show = threshold * 100
 
@@ -290,39 +160,45 @@ if page == "📊 หน้าแสดงผล rate และ ชั่วโ
 
 
     st.subheader("📋 ตาราง Avg Rate - Upper")
-    styled_upper = upper_df.style.apply(
-    lambda row: highlight_fixed_rate_row(row, "Avg Rate (Upper)", permanent_fixed_upper, permanent_yellow_upper),
-    axis=1).format("{:.6f}")
-    st.write(styled_upper)
+    st.markdown(rate_table_html(upper_df, "Avg Rate (Upper)", permanent_fixed_upper, permanent_yellow_upper,
+                                rejected_upper, table_id="upper_rates"), unsafe_allow_html=True)
 
 
 
     st.subheader("📋 ตาราง Avg Rate - Lower")
-    styled_lower = lower_df.style.apply(
-    lambda row: highlight_fixed_rate_row(row, "Avg Rate (Lower)", permanent_fixed_lower, permanent_yellow_lower),
-    axis=1).format("{:.6f}")
-    st.write(styled_lower)
+    st.markdown(rate_table_html(lower_df, "Avg Rate (Lower)", permanent_fixed_lower, permanent_yellow_lower,
+                                rejected_lower, table_id="lower_rates"), unsafe_allow_html=True)
 
     st.markdown("🟩 **สีเขียว** = ค่าคงที่ที่นำไปใช้ในกราฟ")
     st.markdown("🟨 **ตัวอักษรสีเหลือง** = ค่า Rate ที่ทำให้ค่าเฉลี่ยกลายเป็น 'คงที่'")
     st.markdown("🔴 **สีแดง** = ค่า Rate ยังไม่คงที่")
 
+    if estimator in ROBUST_ESTIMATORS:
+        st.markdown(f"⬛ **พื้นเทา ขีดฆ่า** = รอบที่ถูกตัดออก ({ESTIMATORS[estimator]}) ค่าที่ใช้อยู่ในคอลัมน์ Robust Rate")
+        upper_avg, lower_avg = robust_upper.avg, robust_lower.avg
+
+    if estimator == ESTIMATOR_LEAST_SQUARES:
+        trend = least_squares_trend(SHEET_ID)  # fit ทุกรอบในประวัติ cache ตามข้อมูลรอบ
+        upper_avg, lower_avg = trend.rate[0].tolist(), trend.rate[1].tolist()
 
+        st.subheader("📐 ผล Least squares (ความยาว vs ชั่วโมงสะสม)")
+        st.dataframe(pd.DataFrame({
+            "Brush #": brush_numbers,
+            "Rate Upper": trend.rate[0],
+            "Intercept Upper": trend.intercept[0],
+            "Residual Var Upper": trend.residual_var[0],
+            "Points Upper": trend.points[0],
+            "Rate Lower": trend.rate[1],
+            "Intercept Lower": trend.intercept[1],
+            "Residual Var Lower": trend.residual_var[1],
+            "Points Lower": trend.points[1],
+        }), use_container_width=True)
+        st.caption(f"ใช้เฉพาะจุดหลังการเปลี่ยนแปรงครั้งล่าสุด (ความยาวเพิ่มขึ้นเกิน {REPLACEMENT_JUMP_MM:g} mm)")
 
     avg_rate_upper = upper_avg
     avg_rate_lower = lower_avg
     
 
-    if "Sheet7" in xls.sheet_names:
-            df_sheet7 = xls.parse("Sheet7", header=None)
-            upper_current = pd.to_numeric(df_sheet7.iloc[2:34, 5], errors='coerce').values
-            lower_current = pd.to_numeric(df_sheet7.iloc[2:34, 2], errors='coerce').values
-
-    def calculate_hours_safe(current, rate, threshold):
-        return [(c - threshold) / r if pd.notna(c) and r and r > 0 and c > threshold else 0 for c, r in zip(current, rate)]
-
-    hour_upper = calculate_hours_safe(upper_current, avg_rate_upper, length_threshold)
-    hour_lower = calculate_hours_safe(lower_current, avg_rate_lower, length_threshold)
 
     
     
@@ -354,68 +230,29 @@ if page == "📊 หน้าแสดงผล rate และ ชั่วโ
     
 
 
+
+    # กราฟ cache ตามค่า rate (rerun จาก widget อื่นได้กราฟเดิมทันที)
+    rates_upper = np.asarray(avg_rate_upper, dtype=float)
+    rates_lower = np.asarray(avg_rate_lower, dtype=float)
 
     st.subheader("📊 กราฟรวม Avg Rate")
-    fig_combined = go.Figure()
-    fig_combined.add_trace(go.Scatter(x=brush_numbers, y=avg_rate_upper, mode='lines+markers+text', name='Upper Avg Rate', line=dict(color='red'), text=[str(i) for i in brush_numbers], textposition='top center'))
-    fig_combined.add_trace(go.Scatter(x=brush_numbers, y=avg_rate_lower, mode='lines+markers+text', name='Lower Avg Rate', line=dict(color='deepskyblue'), text=[str(i) for i in brush_numbers], textposition='top center'))
-    fig_combined.update_layout(xaxis_title='Brush Number', yaxis_title='Wear Rate (mm/hour)', template='plotly_white')
-    st.plotly_chart(fig_combined, use_container_width=True)
+    st.plotly_chart(avg_rate_figure(brush_numbers, rates_upper, rates_lower), use_container_width=True)
 
 
 
     st.subheader("🔺 กราฟ Avg Rate - Upper")
-    fig_upper = go.Figure()
-    fig_upper.add_trace(go.Scatter(x=brush_numbers, y=avg_rate_upper, mode='lines+markers+text', name='Upper Avg Rate', line=dict(color='red'), text=[str(i) for i in brush_numbers], textposition='top center'))
-    fig_upper.update_layout(xaxis_title='Brush Number', yaxis_title='Wear Rate (mm/hour)', template='plotly_white')
-    st.plotly_chart(fig_upper, use_container_width=True)
+    st.plotly_chart(avg_rate_figure(brush_numbers, upper=rates_upper), use_container_width=True)
 
     st.subheader("🔻 กราฟ Avg Rate - Lower")
-    fig_lower = go.Figure()
-    fig_lower.add_trace(go.Scatter(x=brush_numbers, y=avg_rate_lower, mode='lines+markers+text', name='Lower Avg Rate', line=dict(color='deepskyblue'), text=[str(i) for i in brush_numbers], textposition='top center'))
-    fig_lower.update_layout(xaxis_title='Brush Number', yaxis_title='Wear Rate (mm/hour)', template='plotly_white')
-    st.plotly_chart(fig_lower, use_container_width=True)
+    st.plotly_chart(avg_rate_figure(brush_numbers, lower=rates_lower), use_container_width=True)
 
 
     #sheet_names = [ws.title for ws in sh.worksheets() if ws.title.lower().startswith("sheet")]
     #sheet_count = st.number_input("📌 กรอกจำนวนชีตย้อนหลังที่ต้องใช้", min_value=1, max_value=len(sheet_names), value=6)
     try:
-        
-        xls = pd.ExcelFile(sheet_url_export, engine='openpyxl')
-        
+        # ใช้ rounds ชุดเดียวกับด้านบน (ไม่ต้องดาวน์โหลดซ้ำ)
         selected_sheet_names = sheet_names[:sheet_count]
-        brush_numbers = list(range(1, 33))
-        upper_rates, lower_rates = {n: {} for n in brush_numbers}, {n: {} for n in brush_numbers}
-
-        for sheet in selected_sheet_names:
-            df_raw = xls.parse(sheet, header=None)
-            try:
-                hours = float(df_raw.iloc[0, 7])
-            except:
-                continue
-            df = xls.parse(sheet, skiprows=2, header=None)
-
-            lower_df = df.iloc[:, 0:3]
-            lower_df.columns = ["No_Lower", "Lower_Previous", "Lower_Current"]
-            lower_df = lower_df.dropna().apply(pd.to_numeric, errors='coerce')
-
-            upper_df = df.iloc[:, 4:6]
-            upper_df.columns = ["Upper_Current", "Upper_Previous"]
-            upper_df = upper_df.dropna().apply(pd.to_numeric, errors='coerce')
-            upper_df["No_Upper"] = range(1, len(upper_df) + 1)
-
-            for n in brush_numbers:
-                u_row = upper_df[upper_df["No_Upper"] == n]
-                if not u_row.empty:
-                    diff = u_row.iloc[0]["Upper_Current"] - u_row.iloc[0]["Upper_Previous"]
-                    rate = diff / hours if hours > 0 else np.nan
-                    upper_rates[n][f"Upper_{sheet}"] = rate if rate > 0 else np.nan
-
-                l_row = lower_df[lower_df["No_Lower"] == n]
-                if not l_row.empty:
-                    diff = l_row.iloc[0]["Lower_Previous"] - l_row.iloc[0]["Lower_Current"]
-                    rate = diff / hours if hours > 0 else np.nan
-                    lower_rates[n][f"Lower_{sheet}"] = rate if rate > 0 else np.nan
+        brush_numbers = list(range(1, layout.brush_count + 1))
 
         def avg_positive(row):
             valid = row[row > 0]
@@ -425,17 +262,21 @@ if page == "📊 หน้าแสดงผล rate และ ชั่วโ
         avg_rate_upper = upper_avg
         avg_rate_lower = lower_avg
 
-        df_current = xls.parse(f"Sheet{sheet_count}", header=None, skiprows=2)
-        upper_current = pd.to_numeric(df_current.iloc[0:32, 5], errors='coerce').values
-        lower_current = pd.to_numeric(df_current.iloc[0:32, 2], errors='coerce').values
-
-        def calculate_hours_safe(current, rate, threshold):
-            return [(c - threshold) / r if pd.notna(c) and r and r > 0 and c > threshold else 0 for c, r in zip(current, rate)]
+        current_round = rounds[f"Sheet{sheet_count}"]
+        upper_current = current_round.upper_current
+        lower_current = current_round.lower_current
 
         length_threshold = st.number_input("📏 ความยาวที่ต้องการให้แจ้งเตือน (mm)", min_value=30.0, max_value=50.0, value=length_threshold, step=0.5)
 
-        hour_upper = calculate_hours_safe(upper_current, avg_rate_upper, length_threshold)
-        hour_lower = calculate_hours_safe(lower_current, avg_rate_lower, length_threshold)
+        # ⏳ ชั่วโมง/วันที่ที่เหลือของทุกแปรงทั้ง Upper และ Lower ในครั้งเดียว (ใช้ทั้งตาราง กราฟ และแจ้งเตือน)
+        # ขั้น forecast: เปลี่ยน length_threshold → คำนวณใหม่แค่ขั้นนี้กับกราฟ
+        forecast = forecast_stage(
+            SHEET_ID, selected_sheet_names, current_round.name,
+            np.vstack([avg_rate_upper, avg_rate_lower]),
+            np.vstack([[n in permanent_fixed_upper for n in brush_numbers],
+                       [n in permanent_fixed_lower for n in brush_numbers]]),
+            length_threshold)
+        hour_upper, hour_lower = forecast.hours
 
         #ให้กรอกค่า input ใน google sheet range brush to need notify
 
@@ -448,6 +289,8 @@ if page == "📊 หน้าแสดงผล rate และ ชั่วโ
             "Avg Rate Lower": avg_rate_lower,
             "Remaining Hours Upper": hour_upper,
             "Remaining Hours Lower": hour_lower,
+            "Projected Date Upper": forecast.dates[0],
+            "Projected Date Lower": forecast.dates[1],
         })
         st.dataframe(result_df, use_container_width=True)
         
@@ -478,17 +321,30 @@ if page == "📊 หน้าแสดงผล rate และ ชั่วโ
             except Exception as e:
                 print("❌ Exception while sending LINE:", e)
 
-        # 🔔 แจ้งเตือน hour ต่ำกว่า 100
-        for i, hour in enumerate(hour_upper):
-            if hour < alert_threshold_hours and hour > 0:
-                send_line_alert(USER_ID, LINE_TOKEN, f"⚠️ Brush #{i+1} (Upper) เหลือ {hour:.1f} ชั่วโมง")
+        # 🔔 แจ้งเตือนแปรงที่ชั่วโมงเหลือน้อยกว่าเกณฑ์
+        alerts = forecast.alerts(alert_threshold_hours)
+        for side_index, side_name in enumerate(["Upper", "Lower"]):
+            for i in np.flatnonzero(alerts[side_index]):
+                hour = forecast.hours[side_index, i]
+                send_line_alert(USER_ID, LINE_TOKEN, f"⚠️ Brush #{i+1} ({side_name}) เหลือ {hour:.1f} ชั่วโมง")
                 st.write(f"📣 แจ้งเตือน Brush #{i+1} เพราะเหลือ {hour:.1f} ชั่วโมง")
 
-
-        for i, hour in enumerate(hour_lower):
-            if hour < alert_threshold_hours and hour > 0:
-                send_line_alert(USER_ID, LINE_TOKEN, f"⚠️ Brush #{i+1} (Lower) เหลือ {hour:.1f} ชั่วโมง")
-                st.write(f"📣 แจ้งเตือน Brush #{i+1} เพราะเหลือ {hour:.1f} ชั่วโมง")
+        # 🎲 ช่วงชั่วโมงที่เหลือแบบความน่าจะเป็น (สุ่มจาก rate ในอดีตของแต่ละแปรง)
+        if st.checkbox("🎲 แสดง P10 / P50 / P90 ของชั่วโมงที่เหลือ (Monte Carlo)"):
+            bands = remaining_life_bands(SHEET_ID, selected_sheet_names, current_round.name,
+                                         length_threshold, alert_threshold_hours)
+            st.dataframe(pd.DataFrame({
+                "Brush #": brush_numbers,
+                "Upper P10": bands.p10[0],
+                "Upper P50": bands.p50[0],
+                "Upper P90": bands.p90[0],
+                f"Upper โอกาสถึงเกณฑ์ใน {alert_threshold_hours} ชม.": bands.prob_alert[0],
+                "Lower P10": bands.p10[1],
+                "Lower P50": bands.p50[1],
+                "Lower P90": bands.p90[1],
+                f"Lower โอกาสถึงเกณฑ์ใน {alert_threshold_hours} ชม.": bands.prob_alert[1],
+            }), use_container_width=True)
+            st.caption(f"สุ่ม {MC_SAMPLES:,} ครั้งต่อแปรง จาก rate ของ {len(selected_sheet_names)} ชีตที่เลือก (bootstrap ค่าเฉลี่ย)")
 
 
     
@@ -504,32 +360,21 @@ if page == "📊 หน้าแสดงผล rate และ ชั่วโ
     
     
     # บันทึกค่าลง Google Sheet
-        save_config_to_sheet(sh, "Sheet1", sheet_count, min_required, threshold_percent, alert_threshold_hours, length_threshold)
+        save_config_to_sheet(sh, config, replace(
+            config, sheet_count=sheet_count, min_required=min_required, threshold_percent=threshold_percent,
+            alert_threshold_hours=alert_threshold_hours, length_threshold=length_threshold), layout)
 
         
         
         st.subheader(f"📊 กราฟ Remaining Hours ถึง {length_threshold:.1f} mm")
 
-        fig, (ax1, ax2) = plt.subplots(2, 1, figsize=(14, 8))
-
-        color_upper = ['black' if h < 500 else 'red' for h in hour_upper]
-        bars1 = ax1.bar(brush_numbers, hour_upper, color=color_upper)
-        ax1.set_title("Remaining Hours to Reach 35mm - Upper")
-        ax1.set_ylabel("Hours")
-        ax1.set_xticks(brush_numbers)
-        for bar, val in zip(bars1, hour_upper):
-            ax1.text(bar.get_x() + bar.get_width()/2, bar.get_height() + 10, f"{int(val)}", ha='center', fontsize=8)
-
-        color_lower = ['black' if h < 500 else 'deepskyblue' for h in hour_lower]
-        bars2 = ax2.bar(brush_numbers, hour_lower, color=color_lower)
-        ax2.set_title("Remaining Hours to Reach 35mm - Lower")
-        ax2.set_ylabel("Hours")
-        ax2.set_xticks(brush_numbers)
-        for bar, val in zip(bars2, hour_lower):
-            ax2.text(bar.get_x() + bar.get_width()/2, bar.get_height() + 10, f"{int(val)}", ha='center', fontsize=8)
-
-        plt.tight_layout()
-        st.pyplot(fig)
+        chart_mode = st.radio("แสดงกราฟแบบ", ["Plotly", "ภาพ (matplotlib)"], horizontal=True, key="remaining_chart_mode")
+        if chart_mode == "Plotly":
+            st.plotly_chart(remaining_hours_figure(brush_numbers, hour_upper, hour_lower, length_threshold),
+                            use_container_width=True)
+        else:
+            st.image(remaining_hours_png(brush_numbers, hour_upper, hour_lower, length_threshold),
+                     use_container_width=True)
 
     except Exception as e:
         st.error(f"เกิดข้อผิดพลาด: {e}")
@@ -548,82 +393,18 @@ if page == "📊 หน้าแสดงผล rate และ ชั่วโ
 elif page == "📝 กรอกข้อมูลแปลงถ่านเพิ่มเติม":
     st.title("📝 กรอกข้อมูลแปรงถ่าน + ชั่วโมง")
     
-    from io import BytesIO
-    import requests
-
-    sheet_id = "1Pd6ISon7-7n7w22gPs4S3I9N7k-6uODdyiTvsfXaSqY"
-    url = f"https://docs.google.com/spreadsheets/d/{sheet_id}/export?format=xlsx"
-    response = requests.get(url)
-
-    xls = pd.ExcelFile(BytesIO(response.content), engine="openpyxl")
-
-
 
-    service_account_info = st.secrets["gcp_service_account"]
-    creds = Credentials.from_service_account_info(service_account_info, scopes=["https://www.googleapis.com/auth/spreadsheets"])
-    gc = gspread.authorize(creds)
-    sh = gc.open_by_url("https://docs.google.com/spreadsheets/d/1Pd6ISon7-7n7w22gPs4S3I9N7k-6uODdyiTvsfXaSqY/edit?usp=sharing")
 
-# ✅ ดึงเฉพาะชีตที่ชื่อขึ้นต้นด้วย Sheet (หรือเปลี่ยนเป็นตาม pattern ของคุณ เช่น "Sheet1", "Sheet2", ...)
-    # ✅ 1. เตรียมรายชื่อชีตทั้งหมดแบบ normalize (รองรับ sheet ชื่อเล็ก/ใหญ่)
-
-
-    sheet_names_all = [ws.title for ws in sh.worksheets()]
-
-    def extract_sheet_number(name):
-        try:
-            return int(name.lower().replace("sheet", ""))
-        except:
-            return float("inf")
-
-    sheet_names = [s for s in sheet_names_all if s.lower().startswith("sheet")]
-    sheet_names_sorted = sorted(sheet_names, key=extract_sheet_number)
-    if "Sheet1" in sheet_names_sorted:
-        sheet_names_sorted.remove("Sheet1")
-        sheet_names_sorted = ["Sheet1"] + sheet_names_sorted
+    sh = get_spreadsheet(SHEET_ID)
+    layout = get_layout(SHEET_ID)  # ตำแหน่งชั่วโมง/วันที่/คอลัมน์แปรงของเครื่องนี้
 
+# ✅ ดึงเฉพาะชีตที่ชื่อขึ้นต้นด้วย Sheet เรียงตามเลข (Sheet1 อยู่บนสุด) จากดัชนีที่ cache ไว้
+    sheet_index = get_worksheet_index(SHEET_ID)
+    sheet_names_sorted = list(sheet_index.ordered)
     sheet_names = sheet_names_sorted
 
-    filtered_sheet_names = [s for s in sheet_names_all if s.lower().startswith("sheet") and s.lower() != "sheet1"]
-
-    # ✅ 2. ดึงตัวเลขของ SheetN
-    sheet_numbers = []
-    for name in filtered_sheet_names:
-        suffix = name.lower().replace("sheet", "")
-        if suffix.isdigit():
-            sheet_numbers.append(int(suffix))
-
-    sheet_numbers.sort()
-    next_sheet_number = sheet_numbers[-1] + 1 if sheet_numbers else 2
-    next_sheet_name = f"Sheet{next_sheet_number}"
-
-    # ทำให้ sheet มีการเรียงกัน
-    def extract_sheet_number(name):
-        try:
-            return int(name.lower().replace("sheet", ""))
-        except:
-            return float('inf')  # สำหรับกรณีชื่อไม่ใช่ตัวเลข
-
-    sheet_names = [s for s in sheet_names_all if s.lower().startswith("sheet")]
-    sheet_names_sorted = sorted(sheet_names, key=extract_sheet_number)
-
-    # ถ้าอยากให้ Sheet1 อยู่บนสุดเสมอ:
-    if "Sheet1" in sheet_names_sorted:
-        sheet_names_sorted.remove("Sheet1")
-        sheet_names_sorted = ["Sheet1"] + sheet_names_sorted
-
-    sheet_names = sheet_names_sorted
-    
-    
-    filtered_sheet_names = [s for s in sheet_names if s.lower() != "sheet1"]
-    sheet_numbers = [
-        int(s.lower().replace("sheet", "")) 
-        for s in filtered_sheet_names if s.lower().replace("sheet", "").isdigit()
-    ]
-    sheet_numbers.sort()
-
-    next_sheet_number = sheet_numbers[-1] + 1 if sheet_numbers else 2
-    next_sheet_name = f"Sheet{next_sheet_number}"
+    # 📌 ชื่อชีตใหม่ (SheetN+1)
+    next_sheet_name = sheet_index.next_name
     
     selected_sheet_auto = st.session_state.get("selected_sheet_auto", "Sheet1")
     if selected_sheet_auto not in sheet_names:
@@ -633,84 +414,49 @@ elif page == "📝 กรอกข้อมูลแปลงถ่านเพ
 
     #st.write(f"🧪 Selected (auto): {selected_sheet_auto}")
     #st.write(f"🧪 Dropdown Options: {sheet_names}")
-   
-
-        # ✅ เตรียมชื่อชีตถัดไป (เช่น Sheet13)
-    
-    
-    next_sheet_number = sheet_numbers[-1] + 1 if sheet_numbers else 2
-    next_sheet_name = f"Sheet{next_sheet_number}"
-
-    
 
 
-        # ดึงเลขชีตล่าสุดก่อนแสดงปุ่ม
-    filtered_sheet_names = [s for s in sheet_names if s.lower().startswith("sheet") and s.lower() != "sheet1"]
-    sheet_numbers = [int(s.lower().replace("sheet", "")) for s in filtered_sheet_names if s.lower().replace("sheet", "").isdigit()]
-    sheet_numbers.sort()
-    next_sheet_name = f"Sheet{sheet_numbers[-1] + 1}" if sheet_numbers else "Sheet2"
-
-    # 📌 คำนวณชื่อชีตใหม่ (SheetN+1)
-    filtered_sheet_names = [s for s in sheet_names if s.lower() != "sheet1"]
-    sheet_numbers = [int(s.lower().replace("sheet", "")) for s in filtered_sheet_names if s.lower().replace("sheet", "").isdigit()]
-    sheet_numbers.sort()
-    next_sheet_number = sheet_numbers[-1] + 1 if sheet_numbers else 2
-    next_sheet_name = f"Sheet{next_sheet_number}"
-
     # 📦 ปุ่มสร้างชีตใหม่
     if st.button(f"➕ สร้างชีตที่ {next_sheet_name} "):
         try:
             # ใช้ sheet ล่าสุดเป็นต้นแบบ
-            last_sheet = f"Sheet{sheet_numbers[-1]}"
-            source_ws = sh.worksheet(last_sheet)
-            df_prev = source_ws.get_all_values()
+            last_sheet = sheet_index.last_round
 
             # คัดลอกค่า current
-            lower_previous_formulas = [[f"={last_sheet}!C{i+3}"] for i in range(32)]
-            upper_previous_formulas = [[f"={last_sheet}!F{i+3}"] for i in range(32)]
+            brush_rows = range(layout.first_row, layout.last_row + 1)
+            lower_previous_formulas = [[f"={last_sheet}!{layout.lower_current_column}{r}"] for r in brush_rows]
+            upper_previous_formulas = [[f"={last_sheet}!{layout.upper_current_column}{r}"] for r in brush_rows]
             
 
             # ตรวจว่าชีตนี้มีอยู่แล้วหรือไม่
-            if next_sheet_name.lower() in [ws.title.lower() for ws in sh.worksheets()]:
+            if next_sheet_name.lower() in [t.lower() for t in sheet_index.titles]:
                 st.warning(f"⚠️ Sheet '{next_sheet_name}' มีอยู่แล้ว")
                 st.stop()
 
-            # สร้างชีตใหม่
-            new_ws = sh.duplicate_sheet(source_sheet_id=source_ws.id, new_sheet_name=next_sheet_name)
-            
-            sheets = sh.worksheets()
-            new_ws = sh.worksheet(next_sheet_name)
-            # ย้าย sheet ไปท้ายสุด
-            sheets = [ws for ws in sheets if ws.title != next_sheet_name]
-            sheets.append(new_ws)
-            sh.reorder_worksheets(sheets)
+            # สร้างชีตใหม่ต่อท้ายสุด (ไม่ต้อง reorder ทีหลัง)
+            new_ws = sh.duplicate_sheet(
+                source_sheet_id=sheet_index.ids[last_sheet],
+                insert_sheet_index=len(sheet_index.titles),
+                new_sheet_name=next_sheet_name)
+            invalidate_worksheet_index()
 
             
                        
                         
             # วางสูตร (ระบุ USER_ENTERED เพื่อให้เป็นสูตร)
-            new_ws.update("B3:B34", lower_previous_formulas, value_input_option="USER_ENTERED")
-            new_ws.update("E3:E34", upper_previous_formulas, value_input_option="USER_ENTERED")
+            new_ws.update(layout.column_range(layout.lower_previous_column), lower_previous_formulas, value_input_option="USER_ENTERED")
+            new_ws.update(layout.column_range(layout.upper_previous_column), upper_previous_formulas, value_input_option="USER_ENTERED")
             
             
             try:
-                new_ws.update("B3:B34", lower_previous_formulas, value_input_option="USER_ENTERED")
-                new_ws.update("E3:E34", upper_previous_formulas, value_input_option="USER_ENTERED")
+                new_ws.update(layout.column_range(layout.lower_previous_column), lower_previous_formulas, value_input_option="USER_ENTERED")
+                new_ws.update(layout.column_range(layout.upper_previous_column), upper_previous_formulas, value_input_option="USER_ENTERED")
             except Exception as e:
                 st.error(f"❌ เกิดข้อผิดพลาดขณะใส่สูตร: {e}")
 
 
-            from gspread.utils import rowcol_to_a1
-            
-            import time
-
-            for i in range(32):
-
-                if i % 10 == 0:
-                    time.sleep(2)
-
-
 
+            invalidate_revision()
             st.session_state["selected_sheet_auto"] = next_sheet_name  # ✅ เพิ่มบรรทัดนี้
             st.success(f"✅ สร้างชีต '{next_sheet_name}' สำเร็จแล้ว 🎉")
             st.rerun()
@@ -722,89 +468,87 @@ elif page == "📝 กรอกข้อมูลแปลงถ่านเพ
 
 
 
-    # โหลดค่าทันทีจาก selected_sheet
-    ws = sh.worksheet(selected_sheet)
-    df_prev = ws.get_all_values()
-
-    lower_current = [row[2] if len(row) > 2 else "" for row in df_prev[2:34]]
-    upper_current = [row[5] if len(row) > 5 else "" for row in df_prev[2:34]]
-
-    # โหลดชั่วโมง/วัน
-    try:
-        default_hours = float(ws.acell("H1").value or 0)
-    except:
-        default_hours = 0.0
-    default_prev_date = ws.acell("A2").value or ""
-    default_curr_date = ws.acell("B2").value or ""
-
-
-    hours = st.number_input("⏱️ ชั่วโมง", min_value=0.0, step=0.1, value=float(default_hours))
-    
-    prev_date = st.text_input("📅 วันที่ตรวจก่อนหน้า", placeholder="DD/MM/YYYY", value=default_prev_date)
-    curr_date = st.text_input("📅 วันที่ตรวจล่าสุด", placeholder="DD/MM/YYYY", value=default_curr_date)
-
- 
-    
-    
-
-    
-
-    st.markdown("### 🔧 แปลงถ่านส่วน LOWER")
-    lower = []
-    cols = st.columns(8)
-    for i in range(32):
-        col = cols[i % 8]
-        with col:
-            st.markdown(f"<div style='text-align: center;'>แปลงถ่านที่ {i+1}</div>", unsafe_allow_html=True)
-            value = st.text_input(
-                label="",  # 👈 ใส่ label เป็นค่าว่าง
-                key=f"lower_input_{i}",
-                value=str(lower_current[i]),
-                label_visibility="collapsed",  # 👈 ซ่อน label แบบสมบูรณ์
-                )
-
-            #value = st.text_input(
-            #f"lower_{i+1}",                     # ชื่อ label
-            #key=f"lower_input_{i}",             # key ไม่ซ้ำ
-            #value=str(lower_current[i]),       # ดึงค่าปัจจุบันมาแสดง
-        #)
-            try:
-                lower.append(float(value))
-            except:
-                lower.append(0.0)
-                
-    st.markdown("### 🔧 แปลงถ่านส่วน UPPER")
-    upper = []
-    cols = st.columns(8)
-    for i in range(32):
-        col = cols[i % 8]
-        with col:
-            st.markdown(f"<div style='text-align: center;'>แปลงถ่านที่ {i+1}</div>", unsafe_allow_html=True)
-            value = st.text_input(
-                label="",  # 👈 ใส่ label เป็นค่าว่าง
-                key=f"upper_input_{i}",
-                value=str(upper_current[i]),
-                label_visibility="collapsed",  # 👈 ซ่อน label แบบสมบูรณ์
-                )
-
-            try:
-                upper.append(float(value))
-            except:
-                upper.append(0.0)
-
-    if st.button("📤 บันทึก"):
+    # โหลดค่าของ selected_sheet (ทั้งช่วง A1:H34 ในครั้งเดียว cache ตาม revision)
+    ws = sheet_index.worksheet(sh, selected_sheet)
+    current_round = load_round_values(SHEET_ID, selected_sheet)
+
+    def entry_text(value):
+        return "" if pd.isna(value) else f"{value:.15g}"
+
+    default_hours = current_round.hours if current_round.hours is not None and np.isfinite(current_round.hours) else 0.0
+
+    entry_mode = st.radio("⌨️ รูปแบบการกรอก", ["ตาราง (กรอกครบแล้วกดบันทึกครั้งเดียว)", "ช่องกรอกทีละแปรง"],
+                          horizontal=True, key="entry_mode")
+
+    # 📝 ทุกช่องอยู่ใน form เดียว: พิมพ์/แก้ได้โดยไม่ rerun จนกว่าจะกด "บันทึก"
+    with st.form(f"round_entry_{selected_sheet}"):
+        hours = st.number_input("⏱️ ชั่วโมง", min_value=0.0, step=0.1, value=float(default_hours))
+
+        prev_date = st.text_input("📅 วันที่ตรวจก่อนหน้า", placeholder="DD/MM/YYYY", value=current_round.prev_date)
+        curr_date = st.text_input("📅 วันที่ตรวจล่าสุด", placeholder="DD/MM/YYYY", value=current_round.curr_date)
+
+        if entry_mode.startswith("ตาราง"):
+            entry = st.data_editor(
+                pd.DataFrame({
+                    "LOWER": current_round.lower_current,
+                    "UPPER": current_round.upper_current,
+                }, index=pd.RangeIndex(1, layout.brush_count + 1, name="แปลงถ่านที่")),
+                column_config={
+                    "LOWER": st.column_config.NumberColumn("🔧 LOWER (mm)", min_value=0.0),
+                    "UPPER": st.column_config.NumberColumn("🔧 UPPER (mm)", min_value=0.0),
+                },
+                num_rows="fixed", use_container_width=True, height=35 * (layout.brush_count + 1) + 3,
+                key=f"entry_grid_{selected_sheet}")
+            # ช่องว่าง = 0.0 เหมือนช่องกรอกแบบเดิม
+            lower = np.nan_to_num(entry["LOWER"].to_numpy(dtype=float), nan=0.0).tolist()
+            upper = np.nan_to_num(entry["UPPER"].to_numpy(dtype=float), nan=0.0).tolist()
+        else:
+            lower, upper = [], []
+            for title, values, side, out in (("### 🔧 แปลงถ่านส่วน LOWER", current_round.lower_current, "lower", lower),
+                                             ("### 🔧 แปลงถ่านส่วน UPPER", current_round.upper_current, "upper", upper)):
+                st.markdown(title)
+                cols = st.columns(8)
+                for i in range(layout.brush_count):
+                    with cols[i % 8]:
+                        st.markdown(f"<div style='text-align: center;'>แปลงถ่านที่ {i+1}</div>", unsafe_allow_html=True)
+                        value = st.text_input(
+                            label="",  # 👈 ใส่ label เป็นค่าว่าง
+                            key=f"{side}_input_{selected_sheet}_{i}",
+                            value=entry_text(values[i]),
+                            label_visibility="collapsed",  # 👈 ซ่อน label แบบสมบูรณ์
+                            )
+                        try:
+                            out.append(float(value))
+                        except:
+                            out.append(0.0)
+
+        submitted = st.form_submit_button("📤 บันทึก")
+
+    if submitted:
+        # 📅 เขียนวันที่ลงชีตเป็น DD/MM/YYYY เสมอ (รูปแบบเดียวกับที่อ่านกลับมา) วันที่ที่อ่านไม่ได้ไม่บันทึก
+        dates = {"วันที่ตรวจก่อนหน้า": format_sheet_date(prev_date), "วันที่ตรวจล่าสุด": format_sheet_date(curr_date)}
+        bad_dates = [label for label, text in dates.items() if text is None]
+
+    if submitted and bad_dates:
+        st.error(f"❌ อ่านวันที่ไม่ได้: {', '.join(bad_dates)} (กรอกเป็น DD/MM/YYYY) ยังไม่ได้บันทึก")
+    elif submitted:
+        prev_date, curr_date = dates.values()
         try:
-            ws.update("A2", [[prev_date]])
-            ws.update("B2", [[curr_date]])
-            ws.update("H1", [[hours]])
-            
-            # 🟦 อัปเดตค่าของแปรง LOWER ลงคอลัมน์ C (C3:C34)
-            lower_values = [[v] for v in lower]
-            ws.update("C3:C34", lower_values)
-
-            # 🟥 อัปเดตค่าของแปรง UPPER ลงคอลัมน์ F (F3:F34)
-            upper_values = [[v] for v in upper]
-            ws.update("F3:F34", upper_values)
+            # ข้อมูลก่อนบันทึก (ปกติอยู่ใน cache แล้ว) ใช้ต่อยอดแทนการดาวน์โหลดทั้งไฟล์ใหม่หลังบันทึก
+            base_revision = get_revision(SHEET_ID)
+            workbook = load_workbook_data(SHEET_ID)
+
+            # ✍️ เขียนชั่วโมง/วันที่ และ current ทั้ง 2 ด้านใน batch update ครั้งเดียว
+            ws.batch_update([
+                {"range": layout.prev_date_cell, "values": [[prev_date]]},
+                {"range": layout.curr_date_cell, "values": [[curr_date]]},
+                {"range": layout.hours_cell, "values": [[hours]]},
+                {"range": layout.column_range(layout.lower_current_column), "values": [[v] for v in lower]},
+                {"range": layout.column_range(layout.upper_current_column), "values": [[v] for v in upper]},
+            ])
+            # ⚡ revision ใหม่ = ข้อมูลเดิม + รอบนี้ (และ previous ของรอบถัดไป) หน้าอื่นเห็นทันทีโดยไม่ดาวน์โหลดใหม่
+            record_saved_round(SHEET_ID, base_revision, workbook, selected_sheet, hours, prev_date, curr_date,
+                               lower, upper)
 
             st.success(f"✅ บันทึกลง {selected_sheet} แล้วเรียบร้อย")
         except Exception as e:
@@ -812,52 +556,28 @@ elif page == "📝 กรอกข้อมูลแปลงถ่านเพ
 
     # ------------------ แสดงตารางรวม ------------------
     st.subheader("📄 ตารางรวม Upper + Lower (Current / Previous)")
-    import requests
-    from io import BytesIO
-
-    sheet_url_export = "https://docs.google.com/spreadsheets/d/1Pd6ISon7-7n7w22gPs4S3I9N7k-6uODdyiTvsfXaSqY/export?format=xlsx"
-    response = requests.get(sheet_url_export)
-    xls = pd.ExcelFile(BytesIO(response.content), engine="openpyxl")
+    history = load_history(SHEET_ID)  # หลังบันทึกจะได้ revision ใหม่ ส่วนกรณีอื่นมาจาก SQLite ที่ sync ไว้แล้ว
     #https://docs.google.com/spreadsheets/d/1Pd6ISon7-7n7w22gPs4S3I9N7k-6uODdyiTvsfXaSqY/edit?usp=sharing
     
    
     # 📌 เลือกชีตที่ต้องการดู
-    sheet_options = [ws.title for ws in sh.worksheets() if ws.title.lower().startswith("sheet")]
+    sheet_options = sheet_index.sheet_titles
     selected_view_sheet = st.selectbox("📌 เลือกชีตที่ต้องการดู", sheet_options)
 
     try:
-        #คำหนดคำสั่ง
-        selected_ws = sh.worksheet(selected_view_sheet)
-        
-        #ดึงค่ามาจาก google sheet
-        date_prev = selected_ws.acell("A2").value
-        date_curr = selected_ws.acell("B2").value        
-        hour_val = selected_ws.acell("H1").value
+        # วันที่/ชั่วโมงจากการอ่านทั้งช่วงที่ cache ตาม revision (ไม่เรียก acell ทีละช่อง)
+        view_round = load_round_values(SHEET_ID, selected_view_sheet)
+        date_prev = view_round.prev_date
+        date_curr = view_round.curr_date
+        hour_val = "-" if view_round.hours is None else entry_text(view_round.hours)
         
         #เอาไปกรอกใน web
         st.markdown(f"📆 วันที่ Previous: **{date_prev}** | วันที่ Current: **{date_curr}**")
         st.markdown(f"#### ⏱️ ชั่วโมงจาก {selected_view_sheet}: {hour_val} ชั่วโมง")
 
-        df = xls.parse(selected_view_sheet, skiprows=1, header=None)
-        
-        upper_df = df.iloc[:, 4:6]
-        upper_df.columns = ["Upper_Previous", "Upper_Current"]
-        lower_df = df.iloc[:, 1:3]
-        lower_df.columns = ["Lower_Previous", "Lower_Current"]
-        
-        #ลองสลับค่า
-        
-        # กรองเฉพาะค่าตัวเลข (drop non-numeric row)
-        lower_df = lower_df[pd.to_numeric(lower_df["Lower_Current"], errors="coerce").notna()]
-        upper_df = upper_df[pd.to_numeric(upper_df["Upper_Current"], errors="coerce").notna()]
-
-        #ลองแก้หน่อย
-        #combined_df = pd.concat([upper_df.reset_index(drop=True), lower_df.reset_index(drop=True)], axis=1)
-        #st.dataframe(combined_df, use_container_width=True)
-        
-        combined_df = pd.concat([lower_df.reset_index(drop=True), upper_df.reset_index(drop=True)], axis=1)
-        combined_df.insert(0, "Brush No", range(1, len(combined_df) + 1))
-        combined_df.set_index("Brush No", inplace=True)
+        # 🗃️ ดึงจาก SQLite (index ตาม unit, round) แล้วตัดแถวที่ไม่มีค่าทิ้ง
+        combined_df = history.round_frame(SHEET_ID, selected_view_sheet)
+        combined_df = combined_df.dropna(subset=["Lower_Current", "Upper_Current"], how="all")
         st.dataframe(combined_df, use_container_width=True, height=700)
 
 
@@ -921,234 +641,141 @@ elif page == "📈 พล็อตกราฟตามเวลา (แยก U
     st.title("📈 พล็อตกราฟตามเวลา (แยก Upper และ Lower)")
 
     # ✅ ใช้ Google Sheet เดียวทุกจุด
-    sheet_id = "1Pd6ISon7-7n7w22gPs4S3I9N7k-6uODdyiTvsfXaSqY"
-    sheet_url_export = f"https://docs.google.com/spreadsheets/d/{sheet_id}/export?format=xlsx"
-    xls = pd.ExcelFile(sheet_url_export)
+    sheet_id = SHEET_ID
+    workbook = load_workbook_data(sheet_id)
+    rounds = workbook.rounds
 
-    service_account_info = st.secrets["gcp_service_account"]
-    creds = Credentials.from_service_account_info(service_account_info, scopes=["https://www.googleapis.com/auth/spreadsheets"])
-    gc = gspread.authorize(creds)
-    sh = gc.open_by_url(f"https://docs.google.com/spreadsheets/d/{sheet_id}/edit")
+    sh = get_spreadsheet(sheet_id)
 
 
-    # โหลดค่าความยาวจาก B45
-    try:
-        ws = sh.worksheet("Sheet1")
-        length_threshold = float(ws.acell("B45").value)
-    except:
-        length_threshold = 35.0  # fallback
-        
-    # โหลด config จาก Sheet1
-    sheet_count_config, min_required, threshold_percent, alert_threshold_hours, length_threshold = load_config_from_sheet(sh, "Sheet1")
+    # 📥 โหลด config จาก Sheet1 (B41:B45, F40) ครั้งเดียว
+    config = load_config(sheet_id)
+    layout = get_layout(sheet_id)
+    min_required = config.min_required
+    threshold_percent = config.threshold_percent
+    alert_threshold_hours = config.alert_threshold_hours
+    length_threshold = config.length_threshold
     threshold = threshold_percent / 100
 
         
-    sheet_names = [ws.title for ws in sh.worksheets()]
+    sheet_names = get_worksheet_index(sheet_id).sheet1_first  # Sheet1 อยู่บนสุด
     filtered_sheet_names = [s for s in sheet_names if s.lower().startswith("sheet") and s.lower() != "sheet1"]
     
-    avg_rate_upper = st.session_state.get("upper_avg", [0]*32)
-    avg_rate_lower = st.session_state.get("lower_avg", [0]*32)
-
-    
-    
-    
-    if "Sheet1" in sheet_names:
-        sheet_names.remove("Sheet1")
-        sheet_names = ["Sheet1"] + sheet_names
+    avg_rate_upper = st.session_state.get("upper_avg", [0]*layout.brush_count)
+    avg_rate_lower = st.session_state.get("lower_avg", [0]*layout.brush_count)
         
         
-        # ✅ 1. อ่านค่าจาก Google Sheet ก่อน
-    try:
-        ws = sh.worksheet("Sheet1")
-        sheet_save = int(ws.acell("F40").value)
-    except:
-        sheet_save = 6
-
-    # ✅ 2. แล้วจึงใช้ค่าที่ได้ไปตัดชื่อชีต
+    # ✅ จำนวนชีตย้อนหลังเริ่มต้นจาก Sheet1!F40
+    sheet_save = min(max(config.sheet_save, 1), len(sheet_names))
     selected_sheet_names = sheet_names[:sheet_save]
-    
-    
-        # 📥 โหลดค่าคงที่จาก Sheet1
-    try:
-        ws = sh.worksheet("Sheet1")
-        min_required = int(ws.acell("B42").value)
-        threshold_percent = float(ws.acell("B43").value)
-        alert_threshold_hours = int(ws.acell("B44").value)
-        length_threshold = float(ws.acell("B45").value)
-    except:
-        min_required = 5
-        threshold_percent = 5.0
-        alert_threshold_hours = 100
-        length_threshold = 35.0
 
-    threshold = threshold_percent / 100
 
+    # 📌 ให้ผู้ใช้กรอกจำนวนชีต (ใช้แบบ number_input)
+    sheet_count = st.number_input("📌 เลือกจำนวน Sheet ที่ต้องใช้ ", min_value=1, max_value=len(sheet_names), value=sheet_save)
 
+    # ✅ อัปเดตกลับไปยัง Sheet1!F40 เฉพาะเมื่อค่าเปลี่ยน
+    try:
+        save_config(sh, config, replace(config, sheet_save=sheet_count), layout)
+    except Exception as e:
+        st.warning(f"⚠️ ไม่สามารถอัปเดต Sheet1!F40 ได้: {e}")
 
     
+    all_sheet_names = workbook.sheet_names
+    sheet_names = [s for s in all_sheet_names if s.lower().startswith("sheet")][:sheet_count]
 
+    brush_numbers = list(range(1, layout.brush_count + 1))
+    rates = rate_stage(sheet_id, sheet_names, clip=CLIP_NAN)
+    upper_rates, lower_rates = rates.frame("Upper"), rates.frame("Lower")
 
-    # ดึงชื่อชีตจริงจากไฟล์
-    
-    
-    # 📥 โหลดค่าจำนวนชีตย้อนหลังเริ่มต้นจาก Sheet1!F40
-    def safe_int(val, default=6):
-        try:
-            val_str = str(val).strip()
-            if val_str.isdigit():
-                return int(val_str)
-            elif val_str.replace('.', '', 1).isdigit():
-                return int(float(val_str))
-            else:
-                return default
-        except:
-            return default
+    # 🟨 Avg Rate ของหน้า 3 (rate ล่าสุดเทียบค่าเฉลี่ยของรอบก่อนหน้า) คำนวณทุกแปรงในครั้งเดียว
+    avg_rate_upper = last_rate_stabilization(upper_rates.fillna(0).to_numpy(), min_required).avg
+    avg_rate_lower = last_rate_stabilization(lower_rates.fillna(0).to_numpy(), min_required).avg
 
-    try:
-        ws = sh.worksheet("Sheet1")
-        sheet_count_default = safe_int(ws.acell("F40").value)
-    except:
-        sheet_count_default = 6
 
 
-    # 📌 ให้ผู้ใช้กรอกจำนวนชีต (ใช้แบบ number_input)
-    sheet_count = st.number_input("📌 เลือกจำนวน Sheet ที่ต้องใช้ ", min_value=1, max_value=len(sheet_names), value=sheet_save)
 
-    # ✅ อัปเดตกลับไปยัง Sheet1!F40 ทันที
-    try:
-        ws.update("F40", [[str(sheet_count)]])
-    except Exception as e:
-        st.warning(f"⚠️ ไม่สามารถอัปเดต Sheet1!F40 ได้: {e}")
+ 
 
-    
-    all_sheet_names = xls.sheet_names
-    sheet_names = [s for s in all_sheet_names if s.lower().startswith("sheet")][:sheet_count]
+    # ใช้ current จาก sheet ล่าสุด เช่น Sheet{sheet_count} (query จาก SQLite)
+    history = load_history(sheet_id)
+    upper_current, lower_current = history.current_lengths(sheet_id, f"Sheet{sheet_count}", len(brush_numbers))
 
-    brush_numbers = list(range(1, 33))
-    upper_rates, lower_rates = {n: {} for n in brush_numbers}, {n: {} for n in brush_numbers}
+    # ⏱️ แกนเวลายาวจนแปรงสุดท้ายถึง length_threshold (จาก forecast) แทนการตั้งตายตัว 0–200 ชั่วโมง
+    current = np.vstack([upper_current, lower_current])
+    avg_rates = np.vstack([avg_rate_upper, avg_rate_lower])
+    horizon = projection_horizon(forecast_remaining(current, avg_rates, length_threshold).hours)
+    # เส้นตรง → ใช้แค่จุดเริ่ม/จุดปลาย จำนวนจุดที่ส่งไป browser ไม่เพิ่มตามความยาวแกนเวลา
+    time_hours = np.array([0.0, horizon])
+    projected = project_lengths(current, avg_rates, time_hours)  # (ด้าน, แปรง, เวลา)
 
-    for sheet in sheet_names:
-        df_raw = xls.parse(sheet, header=None)
-        try:
-            hours = float(df_raw.iloc[0, 7])
-        except:
-            continue
-        df = xls.parse(sheet, skiprows=2, header=None)
-
-        lower_df = df.iloc[:, 0:3]
-        lower_df.columns = ["No_Lower", "Lower_Previous", "Lower_Current"]
-        lower_df = lower_df.dropna().apply(pd.to_numeric, errors='coerce')
-
-        upper_df = df.iloc[:, 4:6]
-        upper_df.columns = ["Upper_Current", "Upper_Previous"]
-        upper_df = upper_df.dropna().apply(pd.to_numeric, errors='coerce')
-        upper_df["No_Upper"] = range(1, len(upper_df) + 1)
-
-        for n in brush_numbers:
-            u_row = upper_df[upper_df["No_Upper"] == n]
-            if not u_row.empty:
-                diff = u_row.iloc[0]["Upper_Current"] - u_row.iloc[0]["Upper_Previous"]
-                rate = diff / hours if hours > 0 else np.nan
-                upper_rates[n][f"Upper_{sheet}"] = rate if rate > 0 else np.nan
-
-            l_row = lower_df[lower_df["No_Lower"] == n]
-            if not l_row.empty:
-                diff = l_row.iloc[0]["Lower_Previous"] - l_row.iloc[0]["Lower_Current"]
-                rate = diff / hours if hours > 0 else np.nan
-                lower_rates[n][f"Lower_{sheet}"] = rate if rate > 0 else np.nan
-
-    def avg_positive(row_dict):
-        values = [v for v in row_dict.values() if pd.notna(v) and v > 0]
-        return sum(values) / len(values) if values else np.nan
-    
-    def determine_final_rate(previous_rates, new_rate, row_index, sheet_name, mark_dict, min_required=5, threshold=0.1):
-        previous_rates = [r for r in previous_rates if pd.notna(r) and r > 0]
-        if len(previous_rates) >= min_required:
-            avg_rate = sum(previous_rates) / len(previous_rates)
-            percent_diff = abs(new_rate - avg_rate) / avg_rate
-            if percent_diff <= threshold:
-                mark_dict[row_index] = sheet_name
-                return round(avg_rate, 6), True
-        combined = previous_rates + [new_rate] if new_rate > 0 else previous_rates
-        final_avg = sum(combined) / len(combined) if combined else 0
-        return round(final_avg, 6), False
+    render_mode = st.radio("🖌️ วิธีวาดกราฟ", ["รวมเป็นเส้นเดียว (เร็ว)", "แยกเส้นต่อแปรง (WebGL)"], horizontal=True,
+                           key="projection_render_mode")
 
-    def calc_avg_with_flag(rates_dict, rate_fixed_set, mark_dict,min_required, threshold):
-        df = pd.DataFrame.from_dict(rates_dict, orient='index')
-        df = df.reindex(range(1, 33)).fillna(0)
-        avg_col = []
-        for i, row in df.iterrows():
-            values = row[row > 0].tolist()
-            if len(values) >= min_required:
-                prev = values[:-1]
-                new = values[-1]
-                sheet_name = row[row > 0].index[-1] if len(row[row > 0].index) > 0 else ""
-                avg, fixed = determine_final_rate(prev, new, i, sheet_name, mark_dict)
-                avg_col.append(avg)
-                if fixed:
-                    rate_fixed_set.add(i)
-            else:
-                avg_col.append(round(np.mean(values), 6) if values else 0.000000)
-        return df, avg_col
-    
+    def wear_down_figure(side, lengths, dash):
+        fig = go.Figure()
+        if render_mode.startswith("รวม"):
+            # 1 trace ต่อด้าน: ทุกแปรงคั่นด้วย NaN (ชี้ที่เส้นเพื่อดูหมายเลขแปรง)
+            x, y, rows = nan_separated(time_hours, lengths)
+            fig.add_trace(go.Scatter(x=x, y=y, mode="lines", name=side, line=dict(dash=dash, width=1),
+                                     text=[f"{side} {n + 1}" for n in rows],
+                                     hovertemplate="%{text}<br>%{x:.0f} ชม. → %{y:.2f} mm<extra></extra>"))
+        else:
+            for n in np.flatnonzero(~np.isnan(lengths).all(axis=1)):
+                fig.add_trace(go.Scattergl(x=time_hours, y=lengths[n], name=f"{side} {n + 1}", mode="lines",
+                                           line=dict(dash=dash)))
+
+        # เส้นแจ้งเตือนตามค่าความยาวที่ต้องการ
+        fig.add_hline(y=length_threshold, line=dict(color="firebrick", width=2, dash="dash"))
+        fig.add_annotation(x=horizon * 0.025, y=length_threshold,
+                           text=f"⚠️ {length_threshold:.1f} mm",
+                           showarrow=False,
+                           font=dict(color="firebrick", size=12),
+                           bgcolor="white")
+        fig.update_layout(title=f"🔺 ความยาว {side} ตามเวลา", xaxis_title="ชั่วโมง", yaxis_title="mm",
+                          xaxis=dict(range=[0, horizon]), yaxis=dict(range=[30, 65]))
+        return fig
+
+    # UPPER
+    st.plotly_chart(wear_down_figure("Upper", projected[0], "solid"), use_container_width=True)
 
-    # ใช้ calc_avg_with_flag ที่คุณมีอยู่แล้ว
-    rate_fixed_upper = set()
-    rate_fixed_lower = set()
-    yellow_mark_upper = {}
-    yellow_mark_lower = {}
+    # LOWER
+    st.plotly_chart(wear_down_figure("Lower", projected[1], "dot"), use_container_width=True)
 
-    upper_df, avg_rate_upper = calc_avg_with_flag(upper_rates, rate_fixed_upper, yellow_mark_upper, min_required, threshold)
-    lower_df, avg_rate_lower = calc_avg_with_flag(lower_rates, rate_fixed_lower, yellow_mark_lower, min_required, threshold)
 
 
+    # 📉 แนวโน้ม rate ตลอดประวัติ (ทุกรอบที่มีในชีต ไม่จำกัดตามจำนวนชีตที่เลือก)
+    st.subheader("📉 แนวโน้ม Rate ตลอดประวัติ")
+    trend_side = st.radio("ฝั่ง", ["upper", "lower"], horizontal=True, key="trend_side")
+    trend_brush = st.selectbox("แปรงถ่านที่", brush_numbers, key="trend_brush")
+    series = history.rate_series(sheet_id, trend_side, trend_brush)
+    if series.empty:
+        st.info("ยังไม่มีข้อมูล rate ของแปรงนี้")
+    else:
+        fig_trend = go.Figure(go.Scatter(x=series["round"], y=series["rate"], mode="lines+markers",
+                                         name=f"{trend_side.capitalize()} {trend_brush}"))
+        fig_trend.update_layout(xaxis_title="รอบ", yaxis_title="Wear Rate (mm/hour)", template="plotly_white")
+        st.plotly_chart(fig_trend, use_container_width=True)
 
 
- 
 
-    # ใช้ current จาก sheet ล่าสุด เช่น Sheet{sheet_count}
-    df_current = xls.parse(f"Sheet{sheet_count}", header=None, skiprows=2)
-    upper_current = pd.to_numeric(df_current.iloc[0:32, 5], errors='coerce').values
-    lower_current = pd.to_numeric(df_current.iloc[0:32, 2], errors='coerce').values
 
-    time_hours = np.arange(0, 201, 10)
+# --------------------------------------------------- PAGE 4 -------------------------------------------------
 
-    # UPPER
-    fig_upper = go.Figure()
-    for i, (start, rate) in enumerate(zip(upper_current, avg_rate_upper)):
-        if pd.notna(start) and pd.notna(rate) and rate > 0:
-            y = [start - rate*t for t in time_hours]
-            fig_upper.add_trace(go.Scatter(x=time_hours, y=y, name=f"Upper {i+1}", mode='lines'))
 
-# เส้นแจ้งเตือนตามค่าความยาวที่ต้องการ
-    fig_upper.add_shape(type="line", x0=0, x1=200, y0=length_threshold, y1=length_threshold,
-                        line=dict(color="firebrick", width=2, dash="dash"))
+elif page == "🏭 ภาพรวมทุกเครื่อง (Fleet)":
+    st.title("🏭 ภาพรวมแปรงถ่านทุกเครื่อง")
 
-    fig_upper.add_annotation(x=5, y=length_threshold,
-                            text=f"⚠️ {length_threshold:.1f} mm",
-                            showarrow=False,
-                            font=dict(color="firebrick", size=12),
-                            bgcolor="white")
+    # ทะเบียนเครื่องมาจาก secrets "fleet_units" = {ชื่อเครื่อง: sheet_id}
+    units = fleet_units()
+    st.caption(f"ประเมินพร้อมกัน {len(units)} เครื่อง: " + ", ".join(units))
 
+    top_n = st.number_input("🔢 จำนวนแปรงที่ใกล้ความยาวแจ้งเตือนที่สุด", min_value=1, max_value=1000, value=20)
 
-    fig_upper.update_layout(title="🔺 ความยาว Upper ตามเวลา", xaxis_title="ชั่วโมง", yaxis_title="mm",
-                            xaxis=dict(dtick=10, range=[0, 200]), yaxis=dict(range=[30, 65]))
-    st.plotly_chart(fig_upper, use_container_width=True)
+    with st.spinner("⚡ กำลังดึงและคำนวณทุกเครื่อง ..."):
+        fleet = evaluate_fleet(units)
 
-    # LOWER
-    fig_lower = go.Figure()
-    for i, (start, rate) in enumerate(zip(lower_current, avg_rate_lower)):
-        if pd.notna(start) and pd.notna(rate) and rate > 0:
-            y = [start - rate*t for t in time_hours]
-            fig_lower.add_trace(go.Scatter(x=time_hours, y=y, name=f"Lower {i+1}", mode='lines', line=dict(dash='dot')))
-
-    fig_lower.add_shape(type="line", x0=0, x1=200, y0=length_threshold, y1=length_threshold,
-                        line=dict(color="firebrick", width=2, dash="dash"))
-    fig_lower.add_annotation(x=5, y=length_threshold,
-                            text=f"⚠️  {length_threshold:.1f} mm",
-                            showarrow=False,
-                            font=dict(color="firebrick", size=12),
-                            bgcolor="white")
-    fig_lower.update_layout(title="🔺 ความยาว Lower ตามเวลา", xaxis_title="ชั่วโมง", yaxis_title="mm",
-                        xaxis=dict(dtick=10, range=[0, 200]), yaxis=dict(range=[30, 65]))
-    st.plotly_chart(fig_lower, use_container_width=True)
+    for name, error in fleet.errors.items():
+        st.warning(f"⚠️ โหลดเครื่อง {name} ไม่ได้: {error}")
+
+    st.subheader("📋 แปรงที่ใกล้ length_threshold ที่สุด (ทุกเครื่อง)")
+    st.dataframe(fleet.closest(int(top_n)), use_container_width=True)
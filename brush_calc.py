@@ -0,0 +1,483 @@
+import warnings
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+
+# ------------------ คำนวณ rate แบบ array (รอบ × ด้าน × แปรง) ------------------
+
+SIDES = ("Upper", "Lower")
+CLIP_ZERO = "zero"   # หน้า 1: rate ติดลบ/ชั่วโมงเป็น 0 → 0
+CLIP_NAN = "nan"     # หน้า 3: rate ติดลบ/ชั่วโมงเป็น 0 → NaN
+
+# วิธีประมาณ Avg Rate
+ESTIMATOR_AVERAGE = "average"                # ค่าเฉลี่ย rate รายรอบ + กฎ rate คงที่ (เดิม)
+ESTIMATOR_LEAST_SQUARES = "least_squares"    # fit ความยาว vs ชั่วโมงสะสม
+ESTIMATOR_MEDIAN = "median"
+ESTIMATOR_TRIMMED = "trimmed_mean"
+ESTIMATOR_MAD = "mad"                        # ตัดค่าที่ห่างจาก median เกิน MAD_CUTOFF เท่าของ MAD แล้วเฉลี่ย
+ROBUST_ESTIMATORS = (ESTIMATOR_MEDIAN, ESTIMATOR_TRIMMED, ESTIMATOR_MAD)
+
+
+@dataclass
+class WearRates:
+    names: list                  # ชื่อชีตของแต่ละแถว (เฉพาะรอบที่อ่านชั่วโมงได้)
+    hours: np.ndarray            # (รอบ,)
+    rates: np.ndarray            # (รอบ, ด้าน, แปรง) ค่าที่ไม่มีการวัดเป็น NaN
+    measured: np.ndarray         # (รอบ, ด้าน, แปรง) มีทั้ง previous และ current
+
+    @property
+    def brush_count(self):
+        return self.rates.shape[2]
+
+    def side(self, side):
+        # (รอบ, แปรง) ของด้านที่เลือก
+        return self.rates[:, SIDES.index(side)]
+
+    def frame(self, side):
+        # ตาราง brush × รอบ แบบเดียวกับที่หน้าเว็บแสดง (คอลัมน์ Upper_SheetN / Lower_SheetN)
+        # รอบที่ไม่มีการวัดเลยสักแปรงจะไม่มีคอลัมน์ เหมือนตอนสร้างจาก dict
+        values = self.side(side)
+        keep = self.measured[:, SIDES.index(side)].any(axis=1)
+        return pd.DataFrame(
+            values[keep].T,
+            index=pd.RangeIndex(1, self.brush_count + 1),
+            columns=[f"{side}_{name}" for name, k in zip(self.names, keep) if k],
+        )
+
+
+def round_lengths(rounds, sheet_names, brush_count=None):
+    # 📐 รวมทุกรอบเป็น array เดียว (รอบ, previous/current, ด้าน, แปรง) ข้ามรอบที่อ่านชั่วโมงไม่ได้
+    # brush_count = None → ใช้ตามความยาวของรอบ (มาจาก BrushLayout ของเครื่องนั้น)
+    used = [rounds[s] for s in sheet_names if s in rounds and rounds[s].hours is not None]
+    if brush_count is None:
+        brush_count = len(used[0].upper_previous) if used else 0
+    lengths = np.full((len(used), 2, len(SIDES), brush_count), np.nan)
+    for i, rnd in enumerate(used):
+        lengths[i, 0, 0] = rnd.upper_previous[:brush_count]
+        lengths[i, 1, 0] = rnd.upper_current[:brush_count]
+        lengths[i, 0, 1] = rnd.lower_previous[:brush_count]
+        lengths[i, 1, 1] = rnd.lower_current[:brush_count]
+    hours = np.array([rnd.hours for rnd in used], dtype=float)
+    return [rnd.name for rnd in used], hours, lengths
+
+
+def wear_rates(rounds, sheet_names, clip=CLIP_ZERO, brush_count=None):
+    # ⚡ rate = (previous - current) / hours ของทุกแปรงทุกรอบด้วยการหารครั้งเดียว
+    return rates_from_lengths(*round_lengths(rounds, sheet_names, brush_count), clip=clip)
+
+
+def rates_from_lengths(names, hours, lengths, clip=CLIP_ZERO):
+    with np.errstate(divide="ignore", invalid="ignore"):
+        rates = (lengths[:, 0] - lengths[:, 1]) / hours[:, None, None]
+
+    measured = ~np.isnan(lengths).any(axis=1)
+    fill = 0.0 if clip == CLIP_ZERO else np.nan
+    rates = np.where((hours > 0)[:, None, None] & (rates > 0), rates, fill)
+    rates[~measured] = np.nan
+    return WearRates(names=names, hours=hours, rates=rates, measured=measured)
+
+
+# ------------------ หา rate คงที่ของทุกแปรงพร้อมกัน ------------------
+
+@dataclass
+class Stabilization:
+    avg: list                    # ค่าเฉลี่ยที่ใช้ต่อแปรง (ปัด 6 ตำแหน่ง)
+    fixed: np.ndarray            # (แปรง,) True = rate คงที่แล้ว
+    fixed_col: np.ndarray        # (แปรง,) คอลัมน์ที่ทำให้คงที่ (ตัวอักษรสีเหลือง), -1 = ยังไม่คงที่
+
+
+def detect_stabilization(values, min_required, threshold):
+    # 🟨 กฎเดิม: เรียง rate ที่ > 0 ของแต่ละแปรงตามรอบ ค่าลำดับที่ j (j >= min_required) ทำให้ rate คงที่
+    # ถ้าห่างจากค่าเฉลี่ยของ j-1 ค่าก่อนหน้าไม่เกิน threshold (ใช้ค่าแรกที่ผ่าน)
+    # ถ้าไม่มีค่าไหนผ่าน ใช้ค่าเฉลี่ยของทุกค่าที่ > 0
+    # values = array (แปรง, รอบ) ที่ NaN ถูกแทนด้วย 0 แล้ว
+    values = np.asarray(values, dtype=float)
+    min_required = max(int(min_required), 1)
+    positive = values > 0
+    kept = np.where(positive, values, 0.0)
+
+    # ผลรวมสะสมแบบไม่รวมคอลัมน์ตัวเอง บวกเรียงซ้ายไปขวาเหมือน sum() เดิม (ผลลัพธ์ตรงกันทุกบิต)
+    prev_sum = np.zeros_like(kept)
+    np.cumsum(kept[:, :-1], axis=1, out=prev_sum[:, 1:])
+    order = np.cumsum(positive, axis=1)          # ลำดับของค่านี้ในบรรดาค่าที่ > 0 (เริ่มที่ 1)
+    prev_count = order - 1
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        prev_avg = np.where(prev_count > 0, prev_sum / prev_count, 0.0)
+        percent_diff = np.where(prev_avg > 0, np.abs(values - prev_avg) / prev_avg, 1.0)
+    hit = positive & (order >= min_required) & (percent_diff <= threshold)
+
+    fixed = hit.any(axis=1)
+    fixed_col = np.where(fixed, hit.argmax(axis=1), -1) if hit.shape[1] else np.full(len(values), -1)
+
+    count = positive.sum(axis=1)
+    total = prev_sum[:, -1] + kept[:, -1] if kept.shape[1] else np.zeros(len(values))
+    avg = []
+    for b in range(len(values)):
+        if fixed[b]:
+            avg.append(round(float(prev_avg[b, fixed_col[b]]), 6))
+        else:
+            avg.append(round(float(total[b] / count[b]), 6) if count[b] else 0.000000)
+    return Stabilization(avg=avg, fixed=fixed, fixed_col=fixed_col)
+
+
+# กฎของหน้า 3 (เทียบเฉพาะ rate ล่าสุด)
+LAST_RATE_MIN_PREVIOUS = 5
+LAST_RATE_THRESHOLD = 0.1
+
+
+def last_rate_stabilization(values, min_required, min_previous=LAST_RATE_MIN_PREVIOUS, threshold=LAST_RATE_THRESHOLD):
+    # 🟨 กฎของหน้า 3: ถ้ามีค่า > 0 อย่างน้อย min_required ค่า ก่อนค่าสุดท้ายมีอย่างน้อย min_previous ค่า
+    # และค่าสุดท้ายห่างจากค่าเฉลี่ยของค่าก่อนหน้าไม่เกิน threshold → ใช้ค่าเฉลี่ยนั้น (คงที่)
+    # นอกนั้นใช้ค่าเฉลี่ยของทุกค่าที่ > 0
+    # values = array (แปรง, รอบ) ที่ NaN ถูกแทนด้วย 0 แล้ว
+    values = np.asarray(values, dtype=float)
+    if values.shape[1] == 0:
+        return Stabilization(avg=[0.000000] * len(values), fixed=np.zeros(len(values), dtype=bool),
+                             fixed_col=np.full(len(values), -1))
+    positive = values > 0
+    kept = np.where(positive, values, 0.0)
+
+    # ผลรวมสะสมแบบไม่รวมคอลัมน์ตัวเอง (บวกเรียงซ้ายไปขวาเหมือน sum() เดิม)
+    prev_sum = np.zeros_like(kept)
+    np.cumsum(kept[:, :-1], axis=1, out=prev_sum[:, 1:])
+    count = positive.sum(axis=1)
+    total = prev_sum[:, -1] + kept[:, -1]
+    rows = np.arange(len(values))
+    last = values.shape[1] - 1 - positive[:, ::-1].argmax(axis=1)    # คอลัมน์ของค่า > 0 ตัวสุดท้าย
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        prev_avg = np.where(count > 1, prev_sum[rows, last] / (count - 1), 0.0)
+        percent_diff = np.where(prev_avg > 0, np.abs(kept[rows, last] - prev_avg) / prev_avg, np.inf)
+        mean_all = np.where(count > 0, total / count, 0.0)
+    fixed = (count >= max(int(min_required), 1)) & (count - 1 >= min_previous) & (percent_diff <= threshold)
+
+    avg = [round(float(v), 6) for v in np.where(fixed, prev_avg, mean_all)]
+    return Stabilization(avg=avg, fixed=fixed, fixed_col=np.where(fixed, last, -1))
+
+
+# ------------------ ตัวประมาณแบบทนค่าผิดปกติ (median / trimmed mean / MAD) ------------------
+
+TRIM_FRACTION = 0.1     # trimmed mean ตัดค่าต่ำสุด/สูงสุดฝั่งละ 10%
+TRIM_MIN_COUNT = 3      # มีค่าอย่างน้อยเท่านี้ → ตัดฝั่งละอย่างน้อย 1 ค่า (10% ของไม่ถึง 10 ค่าปัดลงเป็น 0)
+MAD_CUTOFF = 3.5        # robust z-score ที่เกินนี้ถือว่าเป็นค่าผิดปกติ
+
+
+@dataclass
+class RobustRates:
+    avg: list                    # ค่าที่ใช้ต่อแปรง (ปัด 6 ตำแหน่ง, ไม่มีข้อมูล = 0)
+    rejected: np.ndarray         # (แปรง, รอบ) True = รอบที่ไม่ถูกนำมาคิด
+
+
+def robust_rates(values, method, trim=TRIM_FRACTION, cutoff=MAD_CUTOFF):
+    # 🛡️ คิดจาก rate ที่ > 0 เหมือนกฎเดิม ทุกแปรงพร้อมกัน (values = array (แปรง, รอบ))
+    values = np.asarray(values, dtype=float)
+    positive = values > 0
+    x = np.where(positive, values, np.nan)
+    rejected = np.zeros(values.shape, dtype=bool)
+
+    with warnings.catch_warnings(), np.errstate(divide="ignore", invalid="ignore"):
+        warnings.simplefilter("ignore", RuntimeWarning)   # แปรงที่ไม่มี rate เลย
+        if method == ESTIMATOR_MEDIAN:
+            center = np.nanmedian(x, axis=1)
+        elif method == ESTIMATOR_TRIMMED:
+            count = positive.sum(axis=1, keepdims=True)
+            # ตัดฝั่งละ floor(count × trim) ค่า แต่ไม่น้อยกว่า 1 เมื่อมีตั้งแต่ TRIM_MIN_COUNT ค่า (3 ค่า → เหลือค่ากลาง)
+            cut = np.floor(count * trim).astype(int)
+            cut = np.where(count >= TRIM_MIN_COUNT, np.maximum(cut, 1), cut)
+            rank = np.argsort(np.argsort(np.where(positive, values, np.inf), axis=1, kind="stable"), axis=1)
+            rejected = positive & ((rank < cut) | (rank >= count - cut))
+            center = np.nanmean(np.where(rejected, np.nan, x), axis=1)
+        elif method == ESTIMATOR_MAD:
+            median = np.nanmedian(x, axis=1, keepdims=True)
+            deviation = np.abs(x - median)
+            mad = np.nanmedian(deviation, axis=1, keepdims=True)
+            # MAD = 0 (ค่าเกินครึ่งเท่ากันพอดี) → ใช้ mean absolute deviation แทน
+            mean_ad = np.nanmean(deviation, axis=1, keepdims=True)
+            score = np.where(mad > 0, 0.6745 * deviation / mad, deviation / (1.253314 * mean_ad))
+            rejected = positive & (score > cutoff)
+            center = np.nanmean(np.where(rejected, np.nan, x), axis=1)
+        else:
+            raise ValueError(f"unknown robust estimator: {method}")
+
+    avg = [round(float(v), 6) if np.isfinite(v) else 0.000000 for v in center]
+    return RobustRates(avg=avg, rejected=rejected)
+
+
+# ------------------ พยากรณ์ชั่วโมง/วันที่ที่เหลือ ------------------
+
+SHEET_DATE_FORMAT = "%d/%m/%Y"   # รูปแบบวันที่ A2/B2 ทุก backend (brush_sheet แปลงช่องวันที่เป็นรูปแบบนี้)
+
+
+def parse_sheet_dates(values):
+    # 📅 อ่าน DD/MM/YYYY แบบระบุรูปแบบ (ไม่เดาลำดับวัน/เดือน) แล้วค่อยลอง ISO (YYYY-MM-DD) ที่พิมพ์เป็นข้อความไว้
+    # อ่านไม่ได้ → NaT
+    text = pd.Series(values, dtype=object).fillna("").astype(str).str.strip()
+    dates = pd.to_datetime(text, format=SHEET_DATE_FORMAT, errors="coerce")
+    iso = pd.to_datetime(text.where(dates.isna(), ""), format="ISO8601", errors="coerce")
+    return dates.fillna(iso)
+
+
+def format_sheet_date(text):
+    # วันที่ที่ผู้ใช้กรอก → DD/MM/YYYY ("" = ไม่กรอก, None = อ่านไม่ได้)
+    if not str(text).strip():
+        return ""
+    date = parse_sheet_dates([text]).iloc[0]
+    return None if pd.isna(date) else date.strftime(SHEET_DATE_FORMAT)
+
+
+@dataclass
+class Forecast:
+    hours: np.ndarray            # ชั่วโมงที่เหลือก่อนถึง length_threshold (0 = คำนวณไม่ได้/ถึงเกณฑ์แล้ว แบบเดิม)
+    dates: np.ndarray            # วันที่คาดว่าจะถึงเกณฑ์ (datetime64[D], NaT = ไม่ทราบ)
+    below_threshold: np.ndarray  # ความยาวปัจจุบัน <= length_threshold แล้ว
+    no_current: np.ndarray       # ไม่มีค่าความยาวปัจจุบัน
+    no_rate: np.ndarray          # Avg Rate ไม่ > 0
+    stabilised: np.ndarray       # rate คงที่แล้ว
+
+    @property
+    def usable(self):
+        return ~(self.below_threshold | self.no_current | self.no_rate)
+
+    def alerts(self, alert_hours):
+        # แปรงที่ต้องแจ้งเตือน: ยังเหลือชั่วโมงอยู่แต่น้อยกว่า alert_hours
+        return (self.hours > 0) & (self.hours < alert_hours)
+
+
+def forecast_remaining(current, rate, length_threshold, stabilised=None, start_date=None, hours_per_day=None):
+    # ⏳ (current - threshold) / rate ของทุกแปรงทุกด้านในครั้งเดียว (รับ array รูปอะไรก็ได้ที่ broadcast กันได้)
+    current = np.asarray(current, dtype=float)
+    rate = np.asarray(rate, dtype=float)
+    current, rate = np.broadcast_arrays(current, rate)
+
+    no_current = np.isnan(current)
+    with np.errstate(invalid="ignore"):
+        no_rate = ~(rate > 0)
+        below_threshold = ~no_current & (current <= length_threshold)
+    usable = ~(below_threshold | no_current | no_rate)
+    hours = np.zeros(current.shape)
+    hours[usable] = (current[usable] - length_threshold) / rate[usable]
+
+    dates = np.full(current.shape, np.datetime64("NaT"), dtype="datetime64[D]")
+    start = parse_sheet_dates([start_date]).iloc[0] if start_date else pd.NaT
+    if pd.notna(start) and hours_per_day and hours_per_day > 0:
+        days = np.floor(hours[usable] / hours_per_day).astype("int64")
+        dates[usable] = np.datetime64(start.date(), "D") + days
+
+    stabilised = np.zeros(current.shape, dtype=bool) if stabilised is None else np.broadcast_to(stabilised, current.shape)
+    return Forecast(hours=hours, dates=dates, below_threshold=below_threshold, no_current=no_current,
+                    no_rate=no_rate, stabilised=np.asarray(stabilised, dtype=bool))
+
+
+def operating_hours_per_day(rounds, sheet_names):
+    # ชั่วโมงเดินเครื่องเฉลี่ยต่อวัน จาก H1 และช่วงวันที่ A2→B2 ของแต่ละรอบ (None = ไม่มีรอบที่อ่านวันที่ได้)
+    used = [rounds[s] for s in sheet_names if s in rounds and rounds[s].hours is not None]
+    if not used:
+        return None
+    hours = np.array([rnd.hours for rnd in used], dtype=float)
+    prev = parse_sheet_dates([rnd.prev_date for rnd in used])
+    curr = parse_sheet_dates([rnd.curr_date for rnd in used])
+    days = (curr - prev).dt.days.to_numpy(dtype=float)
+    ok = (days > 0) & (hours > 0)
+    return float(hours[ok].sum() / days[ok].sum()) if ok.any() else None
+
+
+# ------------------ เส้นความยาวที่คาดการณ์ตามเวลา (หน้า 3) ------------------
+
+PROJECTION_STEP_HOURS = 10       # ปัดแกนเวลาขึ้นเป็นทวีคูณของค่านี้
+PROJECTION_MAX_HOURS = 20_000    # กันแกนยาวเกินเมื่อมีแปรงที่ rate เกือบ 0
+
+
+def projection_horizon(hours, step=PROJECTION_STEP_HOURS, max_hours=PROJECTION_MAX_HOURS):
+    # ⏱️ ความยาวแกนเวลา = จนแปรงสุดท้ายถึง length_threshold (hours = Forecast.hours) แทนค่าคงที่ 200 ชั่วโมง
+    hours = np.asarray(hours, dtype=float)
+    remaining = hours[np.isfinite(hours) & (hours > 0)]
+    longest = remaining.max() if remaining.size else 0.0
+    return float(min(max(np.ceil(longest / step), 1) * step, max_hours))
+
+
+def project_lengths(current, rate, time_hours):
+    # 📉 current - rate × t ของทุกแปรงทุกเวลาในการ broadcast ครั้งเดียว คืน array (..., เวลา)
+    # แปรงที่ไม่มี current หรือ rate ไม่ > 0 เป็น NaN ทั้งแถว
+    current = np.asarray(current, dtype=float)[..., None]
+    rate = np.asarray(rate, dtype=float)[..., None]
+    with np.errstate(invalid="ignore"):
+        valid = ~np.isnan(current) & (rate > 0)
+        lengths = current - rate * np.asarray(time_hours, dtype=float)
+    return np.where(valid, lengths, np.nan)
+
+
+def nan_separated(time_hours, lengths):
+    # รวมทุกแถวของ (แปรง, เวลา) เป็นเส้นเดียวคั่นด้วย NaN ให้ plotly วาดเป็น trace เดียว
+    # คืน x, y และเลข index ของแถว (แปรง) ของแต่ละจุด ข้ามแถวที่เป็น NaN ทั้งแถว
+    lengths = np.asarray(lengths, dtype=float)
+    rows = np.flatnonzero(~np.isnan(lengths).all(axis=1))
+    width = lengths.shape[1] + 1
+    x = np.full((len(rows), width), np.nan)
+    y = np.full((len(rows), width), np.nan)
+    x[:, :-1] = time_hours
+    y[:, :-1] = lengths[rows]
+    return x.ravel(), y.ravel(), np.repeat(rows, width)
+
+
+# ------------------ ประเมินทั้งเครื่อง (ใช้ใน fleet mode) ------------------
+
+@dataclass
+class UnitEvaluation:
+    avg: np.ndarray              # (ด้าน, แปรง) Avg Rate ตามกฎ rate คงที่ของหน้า 1
+    fixed: np.ndarray            # (ด้าน, แปรง)
+    current: np.ndarray          # (ด้าน, แปรง) ความยาวปัจจุบัน
+    forecast: Forecast           # (ด้าน, แปรง) ชั่วโมง/วันที่ที่เหลือก่อนถึง length_threshold
+
+
+def evaluate_unit(names, hours, lengths, current, min_required, threshold, length_threshold,
+                  start_date=None, hours_per_day=None, estimator=ESTIMATOR_AVERAGE):
+    # ⚙️ รับ/คืนแค่ numpy array (ไม่แตะ streamlit / cache) เรียกจาก thread ไหนก็ได้
+    # estimator = least squares → lengths ควรเป็นทุกรอบในประวัติ
+    brush_count = lengths.shape[-1]
+    if estimator == ESTIMATOR_LEAST_SQUARES:
+        avg = fit_wear_trend(hours, lengths).rate
+        fixed = np.zeros(avg.shape, dtype=bool)
+    else:
+        rates = rates_from_lengths(names, hours, lengths, clip=CLIP_ZERO)
+        avg, fixed = [], []
+        for s in range(len(SIDES)):
+            values = rates.rates[:, s].T
+            keep = rates.measured[:, s].any(axis=1)
+            values = np.nan_to_num(values[:, keep], nan=0.0)
+            if estimator in ROBUST_ESTIMATORS:
+                avg.append(robust_rates(values, estimator).avg)
+                fixed.append(np.zeros(brush_count, dtype=bool))
+            else:
+                result = detect_stabilization(values, min_required, threshold)
+                avg.append(result.avg)
+                fixed.append(result.fixed)
+        avg = np.array(avg, dtype=float).reshape(len(SIDES), brush_count)
+        fixed = np.array(fixed, dtype=bool).reshape(avg.shape)
+    current = np.asarray(current, dtype=float)
+    forecast = forecast_remaining(current, avg, length_threshold, fixed, start_date, hours_per_day)
+    return UnitEvaluation(avg=avg, fixed=fixed, current=current, forecast=forecast)
+
+
+# ------------------ least squares: ความยาว vs ชั่วโมงเดินเครื่องสะสม ------------------
+
+REPLACEMENT_JUMP_MM = 1.0   # ความยาวเพิ่มขึ้นเกินนี้ = เปลี่ยนแปรงใหม่ (เริ่ม fit ใหม่จากจุดนั้น)
+
+
+@dataclass
+class WearTrend:
+    slope: np.ndarray            # (ด้าน, แปรง) mm ต่อชั่วโมง (ติดลบเมื่อสึก)
+    intercept: np.ndarray        # (ด้าน, แปรง) ความยาวที่ชั่วโมงสะสม 0
+    residual_var: np.ndarray     # (ด้าน, แปรง) ความแปรปรวนของ residual (n - 2 องศาอิสระ)
+    points: np.ndarray           # (ด้าน, แปรง) จำนวนจุดที่ใช้ fit
+
+    @property
+    def rate(self):
+        # อัตราสึกหรอ (mm/hour) ค่าที่ fit ไม่ได้หรือไม่ได้ลดลงเป็น 0 เหมือน Avg Rate หน้า 1
+        rate = -self.slope
+        with np.errstate(invalid="ignore"):
+            return np.where(rate > 0, rate, 0.0)
+
+
+def fit_wear_trend(hours, lengths, jump=REPLACEMENT_JUMP_MM):
+    # 📐 fit ความยาว = intercept + slope × ชั่วโมงสะสม ของทุกแปรงพร้อมกัน (closed-form least squares)
+    # แต่ละรอบให้ 2 จุด: (ชั่วโมงสะสมต้นรอบ, previous) และ (ชั่วโมงสะสมท้ายรอบ, current)
+    # ใช้เฉพาะจุดหลังการเปลี่ยนแปรงครั้งล่าสุดของแต่ละแปรง
+    hours = np.asarray(hours, dtype=float)
+    lengths = np.asarray(lengths, dtype=float)
+    run = np.where(hours > 0, hours, 0.0)
+    end = np.cumsum(run)
+    x = np.stack([end - run, end], axis=1).reshape(-1)                       # (2 × รอบ,)
+    y = lengths.reshape(-1, *lengths.shape[2:])                              # (2 × รอบ, ด้าน, แปรง)
+    valid = ~np.isnan(y) & np.repeat(hours > 0, 2)[:, None, None]
+
+    # ค่าก่อนหน้าที่มีข้อมูล (forward fill) เพื่อหาจุดที่ความยาวเพิ่มขึ้น
+    order = np.arange(len(y))[:, None, None]
+    last_valid = np.maximum.accumulate(np.where(valid, order, -1), axis=0)
+    before = np.concatenate([np.full((1, *y.shape[1:]), -1), last_valid[:-1]])
+    prev_y = np.take_along_axis(np.nan_to_num(y), np.maximum(before, 0), axis=0)
+    replaced = valid & (before >= 0) & (y > prev_y + jump)
+    start = np.where(replaced, order, 0).max(axis=0)
+    keep = valid & (order >= start)
+
+    # ใช้ผลรวมรอบค่าเฉลี่ย (centered) เพื่อไม่ให้เสียความละเอียดเมื่อชั่วโมงสะสมมาก
+    w = keep.astype(float)
+    xs = x[:, None, None]
+    n = w.sum(axis=0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        mean_x = (w * xs).sum(axis=0) / n
+        mean_y = np.where(keep, y, 0.0).sum(axis=0) / n
+        dx = np.where(keep, xs - mean_x, 0.0)
+        dy = np.where(keep, y - mean_y, 0.0)
+        sxx = (dx * dx).sum(axis=0)
+        slope = np.where((n >= 2) & (sxx > 0), (dx * dy).sum(axis=0) / sxx, np.nan)
+        intercept = mean_y - slope * mean_x
+        residual = np.where(keep, dy - slope * dx, 0.0)
+        residual_var = np.where(n > 2, (residual ** 2).sum(axis=0) / (n - 2), np.nan)
+    return WearTrend(slope=slope, intercept=intercept, residual_var=residual_var, points=n.astype(int))
+
+
+# ------------------ Monte Carlo: ช่วงชั่วโมงที่เหลือ P10 / P50 / P90 ------------------
+
+MC_SAMPLES = 10_000
+MC_CHUNK_VALUES = 4_000_000   # จำนวนค่าที่สุ่มต่อ chunk (คุมหน่วยความจำ)
+MC_EXACT_MAX = 30             # มีค่าในอดีตตั้งแต่นี้ขึ้นไป ใช้การแจกแจงปกติของค่าเฉลี่ย bootstrap แทนการสุ่มทีละค่า
+
+
+@dataclass
+class LifeBands:
+    p10: np.ndarray              # (ด้าน, แปรง) ชั่วโมงที่เหลือ (มองร้าย)
+    p50: np.ndarray
+    p90: np.ndarray
+    prob_alert: np.ndarray       # (ด้าน, แปรง) โอกาสถึง length_threshold ภายใน alert_hours
+    history: np.ndarray          # (ด้าน, แปรง) จำนวน rate ในประวัติที่ใช้สุ่ม
+
+
+def _bootstrap_means(values, samples, rng):
+    # ค่าเฉลี่ยแบบ bootstrap ของแต่ละแถว (ทุกแถวมีจำนวนค่าเท่ากัน) → (samples, แถว)
+    rows, n = values.shape
+    if n >= MC_EXACT_MAX:
+        # ค่าเฉลี่ย bootstrap มี variance = σ² / n และใกล้เคียงการแจกแจงปกติแล้ว
+        return rng.normal(values.mean(axis=1), values.std(axis=1) / np.sqrt(n), size=(samples, rows))
+    chunk = max(1, MC_CHUNK_VALUES // max(rows * n, 1))
+    means = np.empty((samples, rows))
+    for start in range(0, samples, chunk):
+        size = min(chunk, samples - start)
+        idx = rng.integers(0, n, size=(size, rows, n))
+        means[start:start + size] = np.take_along_axis(values[None], idx, axis=2).mean(axis=2)
+    return means
+
+
+def simulate_remaining(rates, current, length_threshold, alert_hours, samples=MC_SAMPLES, seed=0):
+    # 🎲 สุ่ม rate เฉลี่ยของแต่ละแปรงจาก rate ในอดีต (bootstrap) แล้วคิดชั่วโมงที่เหลือของทุก sample
+    # rates = (ด้าน, แปรง, รอบ) ใช้เฉพาะค่าที่ > 0 / current = (ด้าน, แปรง)
+    rates = np.asarray(rates, dtype=float)
+    current = np.asarray(current, dtype=float)
+    sides, brushes = rates.shape[:2]
+    flat = rates.reshape(sides * brushes, -1)
+    positive = flat > 0
+    count = positive.sum(axis=1)
+    rng = np.random.default_rng(seed)
+
+    # เรียงค่าที่ > 0 ไว้หน้าแถว แล้วจัดกลุ่มแปรงที่มีจำนวนค่าเท่ากันเพื่อสุ่มพร้อมกัน
+    packed = np.take_along_axis(np.where(positive, flat, np.nan), np.argsort(~positive, axis=1, kind="stable"), axis=1)
+    sampled = np.full((samples, sides * brushes), np.nan)
+    for n in np.unique(count[count > 0]):
+        rows = np.flatnonzero(count == n)
+        sampled[:, rows] = _bootstrap_means(packed[rows, :n], samples, rng)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        margin = current.reshape(-1) - length_threshold
+        hours = np.where(margin > 0, margin / np.maximum(sampled, np.finfo(float).tiny), 0.0)
+    hours[:, np.isnan(current.reshape(-1)) | (count == 0)] = np.nan
+
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)
+        p10, p50, p90 = np.nanpercentile(hours, [10, 50, 90], axis=0)
+        prob = np.where(np.isnan(hours).all(axis=0), np.nan, (hours <= alert_hours).mean(axis=0))
+
+    shape = (sides, brushes)
+    return LifeBands(p10=p10.reshape(shape), p50=p50.reshape(shape), p90=p90.reshape(shape),
+                     prob_alert=prob.reshape(shape), history=count.reshape(shape))
@@ -0,0 +1,118 @@
+from io import BytesIO
+
+import numpy as np
+import pandas as pd
+import plotly.graph_objects as go
+import streamlit as st
+from matplotlib.figure import Figure
+from plotly.subplots import make_subplots
+
+
+# ------------------ กราฟหน้า 1 (cache ตามค่าใน array + ค่าที่ใช้แสดงผล) ------------------
+# cache hash ค่าของ argument ทุกตัว (numpy array ตาม bytes) → กราฟเดิมไม่ถูกสร้างใหม่ตอน rerun จาก widget อื่น
+# figure plotly ใช้ cache_resource (คืน object เดิม ไม่ต้อง unpickle) ห้ามแก้ figure ที่ได้ไป
+# st.plotly_chart แปลงเป็น dict ใหม่ก่อนส่งอยู่แล้ว
+
+UPPER_COLOR = "red"
+LOWER_COLOR = "deepskyblue"
+NEAR_HOURS = 500        # แท่ง Remaining Hours ที่น้อยกว่านี้เป็นสีดำ
+
+
+def _avg_rate_trace(brush_numbers, rates, name, color):
+    return go.Scatter(x=brush_numbers, y=rates, mode='lines+markers+text', name=name, line=dict(color=color),
+                      text=[str(i) for i in brush_numbers], textposition='top center')
+
+
+@st.cache_resource(max_entries=64, show_spinner=False)
+def avg_rate_figure(brush_numbers, upper=None, lower=None):
+    # 📊 กราฟ Avg Rate ต่อแปรง (ส่งเฉพาะด้านที่ต้องการ)
+    fig = go.Figure()
+    if upper is not None:
+        fig.add_trace(_avg_rate_trace(brush_numbers, upper, 'Upper Avg Rate', UPPER_COLOR))
+    if lower is not None:
+        fig.add_trace(_avg_rate_trace(brush_numbers, lower, 'Lower Avg Rate', LOWER_COLOR))
+    fig.update_layout(xaxis_title='Brush Number', yaxis_title='Wear Rate (mm/hour)', template='plotly_white')
+    return fig
+
+
+def _bar_colors(hours, color):
+    return np.where(np.asarray(hours, dtype=float) < NEAR_HOURS, "black", color).tolist()
+
+
+@st.cache_resource(max_entries=64, show_spinner=False)
+def remaining_hours_figure(brush_numbers, hour_upper, hour_lower, length_threshold):
+    # 📊 Remaining Hours แบบ plotly (วาดที่ browser ไม่ต้อง render ภาพที่ server)
+    fig = make_subplots(rows=2, cols=1, subplot_titles=(
+        f"Remaining Hours to Reach {length_threshold:.1f}mm - Upper",
+        f"Remaining Hours to Reach {length_threshold:.1f}mm - Lower"))
+    for row, (hours, color, side) in enumerate(
+            ((hour_upper, UPPER_COLOR, "Upper"), (hour_lower, LOWER_COLOR, "Lower")), start=1):
+        fig.add_trace(go.Bar(x=brush_numbers, y=hours, name=side, marker_color=_bar_colors(hours, color),
+                             text=[f"{int(v)}" for v in hours], textposition="outside", showlegend=False),
+                      row=row, col=1)
+        fig.update_yaxes(title_text="Hours", row=row, col=1)
+        fig.update_xaxes(tickmode="linear", dtick=1, row=row, col=1)
+    fig.update_layout(height=800, template="plotly_white", margin=dict(l=40, r=40, t=60, b=40))
+    return fig
+
+
+@st.cache_data(max_entries=16, show_spinner=False)
+def remaining_hours_png(brush_numbers, hour_upper, hour_lower, length_threshold):
+    # 🖼️ แบบ matplotlib เดิม render เป็น PNG ครั้งเดียวต่อชุดข้อมูล (ใช้ Figure ตรง ๆ ไม่แตะ state ของ pyplot)
+    fig = Figure(figsize=(14, 8))
+    axes = fig.subplots(2, 1)
+    for ax, hours, color, side in ((axes[0], hour_upper, UPPER_COLOR, "Upper"),
+                                   (axes[1], hour_lower, LOWER_COLOR, "Lower")):
+        bars = ax.bar(brush_numbers, hours, color=_bar_colors(hours, color))
+        ax.set_title(f"Remaining Hours to Reach {length_threshold:.1f}mm - {side}")
+        ax.set_ylabel("Hours")
+        ax.set_xticks(brush_numbers)
+        for bar, val in zip(bars, hours):
+            ax.text(bar.get_x() + bar.get_width()/2, bar.get_height() + 10, f"{int(val)}", ha='center', fontsize=8)
+    fig.tight_layout()
+    buffer = BytesIO()
+    fig.savefig(buffer, format="png", dpi=200, bbox_inches="tight")
+    return buffer.getvalue()
+
+
+# ------------------ ตาราง Avg Rate (สีจาก mask ทั้งตารางในครั้งเดียว) ------------------
+
+STYLE_REJECTED = "background-color: dimgray; text-decoration: line-through"   # รอบที่ตัวประมาณแบบ robust ตัดออก
+STYLE_FIXED = "background-color: green; color: black; font-weight: bold"      # Avg Rate ที่คงที่แล้ว
+STYLE_UNSTABLE = "color: red; font-weight: bold"                               # Avg Rate ที่ยังไม่คงที่
+STYLE_FIXING = "color: yellow; font-weight: bold"                              # รอบที่ทำให้ rate คงที่
+
+
+def rate_table_styles(frame, avg_column, fixed_rates, yellow, rejected=None):
+    # 🎨 CSS ของทุกช่อง (แถว, คอลัมน์) จาก boolean mask
+    # fixed_rates = {แปรง: rate คงที่}, yellow = {แปรง: คอลัมน์ที่ทำให้คงที่}
+    # rejected = array (แปรง, รอบ) ของคอลัมน์รอบแรก ๆ ในตาราง (None = ไม่มี)
+    shape = frame.shape
+    avg_idx = frame.columns.get_loc(avg_column)
+    css = np.full(shape, "", dtype=object)
+
+    yellow_idx = frame.columns.get_indexer([yellow.get(i, "") for i in frame.index])
+    rows = np.flatnonzero((yellow_idx >= 0) & (yellow_idx != avg_idx))
+    css[rows, yellow_idx[rows]] = STYLE_FIXING
+
+    fixed = np.array([fixed_rates.get(i, np.nan) for i in frame.index], dtype=float)
+    avg = frame.iloc[:, avg_idx].to_numpy(dtype=float)
+    with np.errstate(invalid="ignore"):
+        green = np.abs(avg - fixed) < 1e-6          # NaN (ไม่คงที่) → False
+    css[:, avg_idx] = np.where(green, STYLE_FIXED, STYLE_UNSTABLE)
+
+    if rejected is not None:
+        rejected = np.asarray(rejected, dtype=bool)
+        mask = np.zeros(shape, dtype=bool)
+        mask[:, :rejected.shape[1]] = rejected
+        css[mask] = STYLE_REJECTED
+    return css
+
+
+@st.cache_data(max_entries=32, show_spinner=False)
+def rate_table_html(frame, avg_column, fixed_rates, yellow, rejected=None, table_id="rates"):
+    # 📋 HTML ของตาราง (สร้างครั้งเดียวต่อชุดข้อมูล/สี rerun ถัดไปใช้จาก cache)
+    css = rate_table_styles(frame, avg_column, fixed_rates, yellow, rejected)
+    styler = frame.style.set_uuid(table_id).format("{:.6f}")
+    styler = styler.apply(lambda _: pd.DataFrame(css, index=frame.index, columns=frame.columns), axis=None)
+    return f"<div style='overflow-x: auto'>{styler.to_html()}</div>"
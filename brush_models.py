@@ -0,0 +1,189 @@
+import json
+import sqlite3
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+from brush_calc import (
+    CLIP_ZERO, ESTIMATOR_AVERAGE, ESTIMATOR_LEAST_SQUARES, ESTIMATOR_MAD, ESTIMATOR_MEDIAN, ESTIMATOR_TRIMMED, MC_SAMPLES,
+    ROBUST_ESTIMATORS, SIDES, detect_stabilization, fit_wear_trend, forecast_remaining, operating_hours_per_day,
+    robust_rates, round_lengths, simulate_remaining, wear_rates)
+from brush_sheet import (
+    SHEET_ID, _setting, get_layout, get_revision, load_workbook_data, saved_workbook, sheet1_first)
+from brush_store import get_history_store, rounds_fingerprint
+
+
+# ------------------ ตัวประมาณ rate ที่ cache ตามข้อมูลรอบ ------------------
+
+ESTIMATORS = {
+    ESTIMATOR_AVERAGE: "ค่าเฉลี่ย rate รายรอบ (rate คงที่)",
+    ESTIMATOR_LEAST_SQUARES: "Least squares (ความยาว vs ชั่วโมงสะสม)",
+    ESTIMATOR_MEDIAN: "Median",
+    ESTIMATOR_TRIMMED: "Trimmed mean (ตัดฝั่งละ 10%, อย่างน้อย 1 ค่า)",
+    ESTIMATOR_MAD: "ตัดค่าผิดปกติด้วย MAD แล้วเฉลี่ย",
+}
+
+
+def unit_estimator(sheet_id=SHEET_ID):
+    # วิธีเริ่มต้นของแต่ละเครื่อง จาก secrets / env "rate_estimators" = {sheet_id: วิธี}
+    estimators = _setting("rate_estimators") or {}
+    if isinstance(estimators, str):
+        estimators = json.loads(estimators)
+    estimator = dict(estimators).get(sheet_id, ESTIMATOR_AVERAGE)
+    return estimator if estimator in ESTIMATORS else ESTIMATOR_AVERAGE
+
+
+def history_rounds(workbook):
+    # ทุกรอบตามลำดับชีต (Sheet1 อยู่บนสุด) ไม่จำกัดตามจำนวนชีตที่เลือก
+    return sheet1_first(workbook.sheet_names)
+
+
+# ------------------ ขั้นตอนของหน้า 1 (แต่ละขั้น cache ตาม input ของขั้นนั้นเท่านั้น) ------------------
+# ข้อมูลของรอบที่ใช้ (rounds_key) → rate (+ ชีตที่เลือก) → rate คงที่ / robust (+ min_required, threshold / วิธีประมาณ)
+# → forecast (+ Avg Rate, length_threshold) → กราฟ/ตาราง (brush_charts ตามค่าใน array)
+# เปลี่ยน widget ของขั้นไหน ขั้นก่อนหน้าจะมาจาก cache ทั้งหมด
+# key เป็น fingerprint ของรอบ ไม่ใช่ revision ทั้งไฟล์: บันทึก config ใน Sheet1 (B41:B45, F40) ไม่ทำให้คำนวณใหม่
+
+@st.cache_data(max_entries=64, show_spinner=False)
+def _rounds_key(sheet_id, revision, layout, patched, sheet_names):
+    workbook = load_workbook_data(sheet_id)
+    return rounds_fingerprint(workbook.rounds, history_rounds(workbook) if sheet_names is None else sheet_names)
+
+
+def rounds_key(sheet_id, sheet_names=None):
+    # 🔑 fingerprint ของข้อมูลรอบที่เลือก (None = ทุกรอบ) คำนวณครั้งเดียวต่อ revision
+    # patched = ใช้ข้อมูลที่ patch หลังบันทึกอยู่ (หมดอายุแล้วต้องคิดใหม่จากไฟล์จริงแม้ revision เดิม)
+    return _rounds_key(sheet_id, get_revision(sheet_id), get_layout(sheet_id), saved_workbook(sheet_id) is not None,
+                       None if sheet_names is None else tuple(sheet_names))
+
+
+@st.cache_data(max_entries=32, show_spinner=False)
+def _rates(sheet_id, key, layout, sheet_names, clip):
+    workbook = load_workbook_data(sheet_id)
+    return wear_rates(workbook.rounds, list(sheet_names), clip=clip, brush_count=layout.brush_count)
+
+
+def rate_stage(sheet_id, sheet_names, clip=CLIP_ZERO):
+    # WearRates ของชีตที่เลือก (คำนวณใหม่เมื่อรอบที่เลือกถูกแก้ไขหรือเปลี่ยนจำนวนชีต)
+    return _rates(sheet_id, rounds_key(sheet_id, sheet_names), get_layout(sheet_id), tuple(sheet_names), clip)
+
+
+@st.cache_data(max_entries=32, show_spinner=False)
+def _robust(sheet_id, key, layout, sheet_names, estimator):
+    rates = _rates(sheet_id, key, layout, sheet_names, CLIP_ZERO)
+    return {side: robust_rates(rates.frame(side).fillna(0).to_numpy(), estimator) for side in SIDES}
+
+
+def robust_stage(sheet_id, sheet_names, estimator):
+    # {"Upper": RobustRates, "Lower": RobustRates} ของตาราง rate เดียวกับหน้า 1
+    return _robust(sheet_id, rounds_key(sheet_id, sheet_names), get_layout(sheet_id), tuple(sheet_names), estimator)
+
+
+def _current_lengths(workbook, current_sheet, brush_count):
+    # (ด้าน, แปรง) ความยาวปัจจุบันของรอบที่เลือก (ไม่มีรอบนี้ → NaN)
+    current = np.full((len(SIDES), brush_count), np.nan)
+    current_round = workbook.rounds.get(current_sheet)
+    if current_round is not None:
+        current[0] = current_round.upper_current
+        current[1] = current_round.lower_current
+    return current
+
+
+@st.cache_data(max_entries=64, show_spinner=False)
+def _forecast(sheet_id, key, layout, sheet_names, current_sheet, avg, stabilised, length_threshold):
+    workbook = load_workbook_data(sheet_id)
+    current_round = workbook.rounds.get(current_sheet)
+    return forecast_remaining(
+        _current_lengths(workbook, current_sheet, layout.brush_count), avg, length_threshold,
+        stabilised=stabilised,
+        start_date=current_round.curr_date if current_round is not None else None,
+        hours_per_day=operating_hours_per_day(workbook.rounds, list(sheet_names)))
+
+
+def forecast_stage(sheet_id, sheet_names, current_sheet, avg, stabilised, length_threshold):
+    # ⏳ Forecast (ด้าน, แปรง) คำนวณใหม่เฉพาะเมื่อ Avg Rate / แปรงที่คงที่ / length_threshold / ข้อมูลเปลี่ยน
+    key = rounds_key(sheet_id, (*sheet_names, current_sheet))
+    return _forecast(sheet_id, key, get_layout(sheet_id), tuple(sheet_names), current_sheet,
+                     np.asarray(avg, dtype=float), np.asarray(stabilised, dtype=bool), float(length_threshold))
+
+
+@st.cache_data(max_entries=16, show_spinner=False)
+def _least_squares(sheet_id, key, layout):
+    workbook = load_workbook_data(sheet_id)
+    _, hours, lengths = round_lengths(workbook.rounds, history_rounds(workbook), layout.brush_count)
+    return fit_wear_trend(hours, lengths)
+
+
+def least_squares_trend(sheet_id=SHEET_ID):
+    # 📐 WearTrend ของทุกแปรงทั้ง 2 ด้าน (fit ใหม่เฉพาะเมื่อรอบใดรอบหนึ่งถูกแก้ไข)
+    return _least_squares(sheet_id, rounds_key(sheet_id), get_layout(sheet_id))
+
+
+@st.cache_data(max_entries=32, show_spinner="🎲 กำลังจำลอง Monte Carlo ...")
+def _life_bands(sheet_id, key, layout, sheet_names, current_sheet, length_threshold, alert_hours, samples):
+    workbook = load_workbook_data(sheet_id)
+    rates = rate_stage(sheet_id, sheet_names)
+    current = _current_lengths(workbook, current_sheet, layout.brush_count)
+    return simulate_remaining(rates.rates.transpose(1, 2, 0), current, length_threshold, alert_hours, samples)
+
+
+def remaining_life_bands(sheet_id, sheet_names, current_sheet, length_threshold, alert_hours, samples=MC_SAMPLES):
+    # 🎲 P10/P50/P90 ของชั่วโมงที่เหลือ + โอกาสถึงเกณฑ์ภายใน alert_hours (cache ตามข้อมูลรอบและพารามิเตอร์)
+    key = rounds_key(sheet_id, (*sheet_names, current_sheet))
+    return _life_bands(sheet_id, key, get_layout(sheet_id), tuple(sheet_names), current_sheet,
+                       float(length_threshold), float(alert_hours), int(samples))
+
+
+# ------------------ rate คงที่ (permanent fixed) เก็บถาวรใน SQLite ------------------
+
+@dataclass
+class StabilizedRates:
+    avg: dict                    # {"Upper": [Avg Rate ต่อแปรง], "Lower": [...]}
+    fixed: dict                  # {"Upper": {แปรง: rate คงที่}, ...}
+    yellow: dict                 # {"Upper": {แปรง: คอลัมน์ที่ทำให้คงที่ เช่น "Upper_Sheet5"}, ...}
+
+
+def stabilization_frame(rates, min_required, threshold):
+    # ผลของ detect_stabilization ทั้ง 2 ด้าน เป็นแถว (side, brush, rate, fixed_round) สำหรับเก็บลง SQLite
+    rows = []
+    for side in SIDES:
+        df = rates.frame(side).fillna(0)
+        result = detect_stabilization(df.to_numpy(), min_required, threshold)
+        for pos, brush in enumerate(df.index):
+            fixed_round = df.columns[result.fixed_col[pos]] if result.fixed[pos] else None
+            rows.append((side.lower(), int(brush), result.avg[pos], fixed_round))
+    return pd.DataFrame(rows, columns=["side", "brush", "rate", "fixed_round"])
+
+
+@st.cache_data(max_entries=32, show_spinner=False)
+def _stabilized(sheet_id, fingerprint, layout, sheet_names, min_required, threshold):
+    # fingerprint = rounds_key ของ sheet_names (ใช้เป็น key ใน SQLite ด้วย)
+    try:
+        store = get_history_store()
+        frame = store.stabilized(sheet_id, min_required, threshold, sheet_names, fingerprint)
+    except (OSError, sqlite3.Error):
+        store, frame = None, None  # เขียนดิสก์ไม่ได้ → คำนวณอย่างเดียว
+
+    if frame is None:
+        rates = _rates(sheet_id, fingerprint, layout, sheet_names, CLIP_ZERO)
+        frame = stabilization_frame(rates, min_required, threshold)
+        if store is not None:
+            store.save_stabilized(sheet_id, min_required, threshold, sheet_names, fingerprint, frame)
+
+    out = StabilizedRates(avg={}, fixed={}, yellow={})
+    for side in SIDES:
+        rows = frame[frame["side"] == side.lower()].sort_values("brush")
+        out.avg[side] = [float(v) for v in rows["rate"]]
+        fixed = rows[rows["fixed_round"].notna()]
+        out.fixed[side] = {int(b): float(r) for b, r in zip(fixed["brush"], fixed["rate"])}
+        out.yellow[side] = {int(b): c for b, c in zip(fixed["brush"], fixed["fixed_round"])}
+    return out
+
+
+def stabilized_rates(sheet_id, sheet_names, min_required, threshold):
+    # 🟩 คำนวณครั้งเดียวต่อ (เครื่อง, min_required, threshold, ชุดรอบ, ข้อมูลของรอบเหล่านั้น) แล้วใช้ร่วมทุก session
+    # และคงอยู่หลัง restart server
+    return _stabilized(sheet_id, rounds_key(sheet_id, sheet_names), get_layout(sheet_id), tuple(sheet_names),
+                       max(int(min_required), 1), float(threshold))
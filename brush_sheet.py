@@ -0,0 +1,733 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from dataclasses import dataclass, fields, replace
+from datetime import date, datetime, timedelta
+from io import BytesIO
+
+import numpy as np
+import openpyxl
+from openpyxl.utils.cell import column_index_from_string, coordinate_to_tuple, get_column_letter, range_boundaries
+import pandas as pd
+import streamlit as st
+import gspread
+from google.auth.transport.requests import AuthorizedSession
+from google.oauth2.service_account import Credentials
+from requests.adapters import HTTPAdapter
+
+from brush_calc import SHEET_DATE_FORMAT
+
+
+# ✅ Google Sheet หลักของหน้า dashboard
+SHEET_ID = "1Pd6ISon7-7n7w22gPs4S3I9N7k-6uODdyiTvsfXaSqY"
+
+SCOPES = [
+    "https://www.googleapis.com/auth/spreadsheets",
+    "https://www.googleapis.com/auth/drive.metadata.readonly",  # ใช้อ่าน modifiedTime / version ของไฟล์
+]
+
+# ตรวจ revision ไม่บ่อยกว่านี้ (วินาที) และใช้เป็นรอบหมดอายุเมื่ออ่าน revision ไม่ได้
+REVISION_CHECK_TTL = 15
+REVISION_FALLBACK_TTL = 60
+
+# 🔀 วิธีดึงข้อมูล: "xlsx" = export ทั้งไฟล์, "values" = Sheets values.batchGet, "local" = ไฟล์ xlsx ในเครื่อง (ทดสอบ offline)
+INGEST_BACKENDS = ("xlsx", "values", "local")
+
+
+def _setting(name, default=None):
+    # อ่านจาก st.secrets ก่อน ถ้าไม่มีค่อยใช้ environment variable (ชื่อตัวใหญ่)
+    try:
+        if name in st.secrets:
+            return st.secrets[name]
+    except Exception:
+        pass
+    return os.environ.get(name.upper(), default)
+
+
+def ingest_backend():
+    backend = str(_setting("ingest_backend", "xlsx")).lower()
+    return backend if backend in INGEST_BACKENDS else "xlsx"
+
+
+# จำนวน connection ที่เปิดค้างไว้ต่อ host (ใช้ร่วมกันทุก session)
+HTTP_POOL_SIZE = 16
+
+
+@st.cache_resource(show_spinner=False)
+def get_client():
+    # 🔐 สร้าง client ครั้งเดียวต่อ process: token ถูกใช้ซ้ำและต่ออายุเองเมื่อหมดอายุ
+    # ส่วน HTTP connection ถูกเก็บไว้ใน pool (keep-alive) ไม่ต้อง handshake ใหม่ทุกคลิก
+    creds = Credentials.from_service_account_info(st.secrets["gcp_service_account"], scopes=SCOPES)
+    session = AuthorizedSession(creds)
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=HTTP_POOL_SIZE)
+    session.mount("https://", adapter)
+    return gspread.authorize(None, session=session)
+
+
+@st.cache_resource(show_spinner=False)
+def get_spreadsheet(sheet_id=SHEET_ID):
+    # Spreadsheet handle ใช้ร่วมกันทุก session (เปิด open_by_key ครั้งเดียว)
+    return get_client().open_by_key(sheet_id)
+
+
+class SingleFlight:
+    # 🚦 รวมคำขอซ้ำ: ถ้ามี session อื่นกำลังโหลด key เดียวกันอยู่ ให้รอผลของคนนั้นแทนการยิง request ใหม่
+    # ใช้เฉพาะงานที่ไม่อยู่ใน st.cache_* (เช่น sync SQLite) เพราะ cache ของ Streamlit ล็อกต่อ key ให้อยู่แล้ว
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, fn, *args):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _FlightCall()
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn(*args)
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+
+class _FlightCall:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+_flight = SingleFlight()
+
+
+def export_url(sheet_id):
+    return f"https://docs.google.com/spreadsheets/d/{sheet_id}/export?format=xlsx"
+
+
+def edit_url(sheet_id):
+    return f"https://docs.google.com/spreadsheets/d/{sheet_id}/edit"
+
+
+@st.cache_data(ttl=REVISION_CHECK_TTL, show_spinner=False)
+def get_revision(sheet_id):
+    return _fetch_revision(sheet_id)
+
+
+def _fetch_revision(sheet_id):
+    # 🔎 อ่านแค่ metadata ของไฟล์ (เล็กมาก) เพื่อรู้ว่าชีตถูกแก้ไขหรือยัง
+    try:
+        gc = get_client()
+        url = f"https://www.googleapis.com/drive/v3/files/{sheet_id}"
+        params = {"fields": "version,modifiedTime", "supportsAllDrives": True}
+        meta = gc.http_client.request("get", url, params=params).json()
+        return f"{meta.get('version', '')}:{meta.get('modifiedTime', '')}"
+    except Exception:
+        # อ่าน revision ไม่ได้ → ให้ cache หมดอายุตามเวลาแทน
+        return f"ttl:{int(time.time() // REVISION_FALLBACK_TTL)}"
+
+
+def invalidate_revision():
+    # เรียกหลังเขียนข้อมูลลงชีต เพื่อให้ render ถัดไปเห็นข้อมูลใหม่ทันที
+    get_revision.clear()
+
+
+@st.cache_resource(max_entries=4, show_spinner="📥 กำลังโหลดข้อมูลจาก Google Sheet ...")
+def _download_xlsx(sheet_id, revision):
+    # 📦 ดาวน์โหลด 1 ครั้งต่อ revision แล้วแชร์ให้ทุกหน้า/ทุก session
+    return _fetch_xlsx(sheet_id)
+
+
+def _fetch_xlsx(sheet_id):
+    # ใช้ AuthorizedSession เดียวกับ gspread (token + connection pool ที่แชร์กันทุก session)
+    response = get_client().http_client.session.get(export_url(sheet_id), timeout=60)
+    response.raise_for_status()
+    return response.content
+
+
+def load_workbook_bytes(sheet_id=SHEET_ID):
+    return _download_xlsx(sheet_id, get_revision(sheet_id))
+
+
+def open_workbook(sheet_id=SHEET_ID):
+    return pd.ExcelFile(BytesIO(load_workbook_bytes(sheet_id)), engine="openpyxl")
+
+
+# ------------------ รอบการตรวจ (SheetN) ------------------
+
+@dataclass(frozen=True)
+class BrushLayout:
+    # 📐 ตำแหน่งข้อมูลในชีตรอบของเครื่องหนึ่งเครื่อง (1 unit = 1 Google Sheet)
+    brush_count: int = 32
+    first_row: int = 3                      # แถวของแปรงที่ 1 (แถวก่อนหน้าเป็น header)
+    hours_cell: str = "H1"
+    prev_date_cell: str = "A2"
+    curr_date_cell: str = "B2"
+    brush_column: str = "A"
+    lower_previous_column: str = "B"
+    lower_current_column: str = "C"
+    upper_previous_column: str = "E"
+    upper_current_column: str = "F"
+    config_sheet: str = "Sheet1"
+    config_cells: tuple = (                 # (ชื่อ field ของ BrushConfig, ช่อง)
+        ("sheet_count", "B41"),
+        ("min_required", "B42"),
+        ("threshold_percent", "B43"),
+        ("alert_threshold_hours", "B44"),
+        ("length_threshold", "B45"),
+        ("sheet_save", "F40"),
+    )
+
+    @property
+    def key(self):
+        # ใช้แยกสำเนาบนดิสก์ (mirror/SQLite) ของแต่ละ layout เช่น brush_count เปลี่ยน → array ยาวไม่เท่าเดิม
+        return hashlib.sha1(repr(self).encode()).hexdigest()[:16]
+
+    @property
+    def last_row(self):
+        return self.first_row + self.brush_count - 1
+
+    @property
+    def data_columns(self):
+        return {
+            "lower_previous": self.lower_previous_column,
+            "lower_current": self.lower_current_column,
+            "upper_previous": self.upper_previous_column,
+            "upper_current": self.upper_current_column,
+        }
+
+    @property
+    def last_col(self):
+        columns = [self.brush_column, *self.data_columns.values()]
+        header = [coordinate_to_tuple(c) for c in (self.hours_cell, self.prev_date_cell, self.curr_date_cell)]
+        return max([column_index_from_string(c) for c in columns] + [col for _, col in header])
+
+    @property
+    def round_range(self):
+        # ช่วงเดียวที่ครอบ header + ตารางแปรงทั้งหมด เช่น A1:H34
+        return f"A1:{get_column_letter(self.last_col)}{self.last_row}"
+
+    def column_range(self, column):
+        # ช่วงของแปรงทั้งหมดในคอลัมน์เดียว เช่น C3:C34
+        return f"{column}{self.first_row}:{column}{self.last_row}"
+
+    @property
+    def config_field_cells(self):
+        return dict(self.config_cells)
+
+    @property
+    def config_bounds(self):
+        # (min_row, min_col, max_row, max_col) ที่ครอบทุกช่อง config
+        cells = [coordinate_to_tuple(c) for _, c in self.config_cells]
+        rows, cols = [r for r, _ in cells], [c for _, c in cells]
+        return min(rows), min(cols), max(rows), max(cols)
+
+    @property
+    def config_range(self):
+        min_row, min_col, max_row, max_col = self.config_bounds
+        return f"{get_column_letter(min_col)}{min_row}:{get_column_letter(max_col)}{max_row}"
+
+
+DEFAULT_LAYOUT = BrushLayout()
+
+# เครื่องที่รู้จัก (เพิ่ม/แก้ได้ใน secrets ที่ unit_layouts.<sheet_id> โดยไม่ต้องแก้โค้ด)
+UNIT_LAYOUTS = {SHEET_ID: DEFAULT_LAYOUT}
+
+
+def layout_from_spec(spec):
+    # spec = dict ของ field ที่ต่างจาก default เช่น {"brush_count": 240, "config_cells": {"sheet_count": "K1"}}
+    spec = dict(spec)
+    if "config_cells" in spec:
+        spec["config_cells"] = tuple({**DEFAULT_LAYOUT.config_field_cells, **dict(spec["config_cells"])}.items())
+    return replace(DEFAULT_LAYOUT, **spec)
+
+
+def get_layout(sheet_id=SHEET_ID):
+    overrides = _setting("unit_layouts") or {}
+    if isinstance(overrides, str):
+        overrides = json.loads(overrides)
+    if sheet_id in overrides:
+        return layout_from_spec(overrides[sheet_id])
+    return UNIT_LAYOUTS.get(sheet_id, DEFAULT_LAYOUT)
+
+
+@dataclass
+class InspectionRound:
+    name: str
+    hours: float | None          # H1 (None = อ่านไม่ได้ → ข้ามรอบนี้)
+    prev_date: str               # A2
+    curr_date: str               # B2
+    lower_previous: np.ndarray   # B3:B34 (ยาวเท่า brush_count ของ layout)
+    lower_current: np.ndarray    # C3:C34
+    upper_previous: np.ndarray   # E3:E34
+    upper_current: np.ndarray    # F3:F34
+
+
+CONFIG_SHEET = DEFAULT_LAYOUT.config_sheet
+
+
+@dataclass
+class WorkbookData:
+    sheet_names: list
+    rounds: dict                 # {ชื่อชีต: InspectionRound}
+    config_cells: dict           # {"B41": ..., "F40": ...} จาก Sheet1
+
+
+def _cell_text(value):
+    return "" if value is None else str(value)
+
+
+# วันที่ 0 ของเลข serial ใน Google Sheets / Excel
+SERIAL_EPOCH = datetime(1899, 12, 30)
+
+
+def _date_text(value):
+    # 📅 ช่องวันที่ได้ข้อความรูปแบบเดียวกันทุก backend: xlsx → datetime, batchGet → เลข serial, ข้อความ → ตามเดิม
+    if isinstance(value, (datetime, date)):
+        return value.strftime(SHEET_DATE_FORMAT)
+    if isinstance(value, (int, float)) and not isinstance(value, bool) and np.isfinite(value):
+        return (SERIAL_EPOCH + timedelta(days=float(value))).strftime(SHEET_DATE_FORMAT)
+    return _cell_text(value)
+
+
+def _to_number(value):
+    if value is None or isinstance(value, bool):
+        return np.nan
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+
+def _to_hours(value):
+    # H1 ว่างหรือไม่ใช่ตัวเลข = None → ข้ามรอบนี้ (แบบเดิมที่ float(H1) ไม่ผ่านแล้ว continue)
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def round_from_rows(name, rows, layout=DEFAULT_LAYOUT):
+    # rows = ค่าของ layout.round_range (เช่น A1:H34) ทีละแถว (แถวหรือคอลัมน์ที่ขาดให้ถือว่าว่าง)
+    width, height = layout.last_col, layout.last_row
+    rows = [tuple(row) + (None,) * (width - len(row)) for row in rows[:height]]
+    rows += [(None,) * width] * (height - len(rows))
+    block = rows[layout.first_row - 1:]
+
+    def cell(a1):
+        row, col = coordinate_to_tuple(a1)
+        return rows[row - 1][col - 1]
+
+    def column(letter):
+        idx = column_index_from_string(letter) - 1
+        return np.array([_to_number(row[idx]) for row in block], dtype=float)
+
+    return InspectionRound(
+        name=name,
+        hours=_to_hours(cell(layout.hours_cell)),
+        prev_date=_date_text(cell(layout.prev_date_cell)),
+        curr_date=_date_text(cell(layout.curr_date_cell)),
+        **{field: column(letter) for field, letter in layout.data_columns.items()},
+    )
+
+
+def read_workbook_ranges(xlsx_bytes, layout=DEFAULT_LAYOUT):
+    # 📖 อ่านแบบ streaming เฉพาะช่วงรอบ (A1:H34) ของทุกชีต + ช่อง config ของ Sheet1 (ไม่สร้าง DataFrame ทั้งชีต)
+    wb = openpyxl.load_workbook(BytesIO(xlsx_bytes), read_only=True, data_only=True, keep_links=False)
+    try:
+        rounds = {}
+        for ws in wb.worksheets:
+            rows = ws.iter_rows(min_row=1, max_row=layout.last_row, max_col=layout.last_col, values_only=True)
+            rounds[ws.title] = round_from_rows(ws.title, list(rows), layout)
+
+        config_cells = {}
+        if layout.config_sheet in wb.sheetnames:
+            min_row, min_col, max_row, max_col = layout.config_bounds
+            rows = wb[layout.config_sheet].iter_rows(min_row=min_row, max_row=max_row,
+                                                     min_col=min_col, max_col=max_col, values_only=True)
+            config_cells = config_from_rows(list(rows), layout)
+
+        return WorkbookData(sheet_names=list(wb.sheetnames), rounds=rounds, config_cells=config_cells)
+    finally:
+        wb.close()
+
+
+def config_from_rows(rows, layout=DEFAULT_LAYOUT):
+    # rows = ค่าของ layout.config_range (เช่น Sheet1!B40:F45)
+    min_row, min_col, _, _ = layout.config_bounds
+    config_cells = {}
+    for _, cell in layout.config_cells:
+        row, col = coordinate_to_tuple(cell)
+        values = rows[row - min_row] if row - min_row < len(rows) else ()
+        value = values[col - min_col] if col - min_col < len(values) else None
+        config_cells[cell] = None if value == "" else value
+    return config_cells
+
+
+# ------------------ ดึงผ่าน Sheets API values.batchGet ------------------
+
+# วันที่มาเป็นเลข serial (ไม่ขึ้นกับรูปแบบการแสดงผลของชีต) แล้วแปลงด้วย _date_text แบบเดียวกับ xlsx
+VALUES_PARAMS = {"valueRenderOption": "UNFORMATTED_VALUE", "dateTimeRenderOption": "SERIAL_NUMBER"}
+
+
+def _a1_sheet(title):
+    return "'" + title.replace("'", "''") + "'"
+
+
+def read_values_ranges(sh, layout=DEFAULT_LAYOUT):
+    # 📡 ดึงช่วงรอบของทุกชีต + ช่อง config ของ Sheet1 ใน batchGet ครั้งเดียว (JSON เล็กกว่า xlsx มาก)
+    titles = [ws.title for ws in sh.worksheets()]
+    ranges = [f"{_a1_sheet(title)}!{layout.round_range}" for title in titles]
+    has_config = layout.config_sheet in titles
+    if has_config:
+        ranges.append(f"{_a1_sheet(layout.config_sheet)}!{layout.config_range}")
+
+    value_ranges = sh.values_batch_get(ranges, params=VALUES_PARAMS).get("valueRanges", [])
+    rows_by_range = [vr.get("values", []) for vr in value_ranges]
+
+    rounds = {title: round_from_rows(title, rows, layout) for title, rows in zip(titles, rows_by_range)}
+    config_cells = config_from_rows(rows_by_range[len(titles)], layout) if has_config else {}
+    return WorkbookData(sheet_names=titles, rounds=rounds, config_cells=config_cells)
+
+
+def read_round(ws, layout=DEFAULT_LAYOUT):
+    # 📖 อ่านรอบเดียว (ช่วง A1:H34 ทั้งก้อน) ด้วยการเรียก API ครั้งเดียว
+    rows = ws.get(layout.round_range, value_render_option=VALUES_PARAMS["valueRenderOption"],
+                  date_time_render_option=VALUES_PARAMS["dateTimeRenderOption"])
+    return round_from_rows(ws.title, rows, layout)
+
+
+class LocalSpreadsheet:
+    # 🧪 ตัวแทน gspread.Spreadsheet จากไฟล์ xlsx ในเครื่อง ใช้ทดสอบเส้นทาง batchGet แบบ offline
+    def __init__(self, path):
+        self.path = path
+        self.id = f"local:{path}"
+
+    def _open(self):
+        return openpyxl.load_workbook(self.path, read_only=True, data_only=True, keep_links=False)
+
+    def worksheets(self):
+        wb = self._open()
+        try:
+            return [_LocalWorksheet(title) for title in wb.sheetnames]
+        finally:
+            wb.close()
+
+    def values_batch_get(self, ranges, params=None):
+        wb = self._open()
+        try:
+            value_ranges = []
+            for a1_range in ranges:
+                sheet, cells = a1_range.rsplit("!", 1)
+                title = sheet[1:-1].replace("''", "'") if sheet.startswith("'") else sheet
+                min_col, min_row, max_col, max_row = range_boundaries(cells)
+                rows = wb[title].iter_rows(min_row=min_row, max_row=max_row,
+                                           min_col=min_col, max_col=max_col, values_only=True)
+                value_ranges.append({"range": a1_range, "values": [_trim_row(row) for row in rows]})
+            # API ตัดแถวว่างท้ายช่วงทิ้ง
+            for vr in value_ranges:
+                while vr["values"] and not vr["values"][-1]:
+                    vr["values"].pop()
+            return {"spreadsheetId": self.id, "valueRanges": value_ranges}
+        finally:
+            wb.close()
+
+
+class _LocalWorksheet:
+    def __init__(self, title):
+        self.title = title
+
+
+def _trim_row(row):
+    values = ["" if v is None else v for v in row]
+    while values and values[-1] == "":
+        values.pop()
+    return values
+
+
+@st.cache_data(max_entries=4, show_spinner=False)
+def _read_workbook(sheet_id, revision, layout):
+    return read_workbook_ranges(_download_xlsx(sheet_id, revision), layout)
+
+
+@st.cache_data(max_entries=4, show_spinner="📡 กำลังดึงข้อมูลจาก Google Sheets API ...")
+def _read_values(sheet_id, revision, layout):
+    return read_values_ranges(get_spreadsheet(sheet_id), layout)
+
+
+@st.cache_data(max_entries=4, show_spinner=False)
+def _read_local(path, mtime, layout):
+    return read_values_ranges(LocalSpreadsheet(path), layout)
+
+
+def fetch_workbook_data(sheet_id=SHEET_ID, backend=None):
+    # ทุก backend คืน WorkbookData หน้าตาเดียวกัน และ cache ตาม revision + layout ของเครื่อง
+    backend = backend or ingest_backend()
+    layout = get_layout(sheet_id)
+    if backend == "local":
+        path = _setting("local_workbook")
+        return _read_local(path, os.path.getmtime(path), layout)
+    revision = get_revision(sheet_id)
+    if backend == "values":
+        return _read_values(sheet_id, revision, layout)
+    return _read_workbook(sheet_id, revision, layout)
+
+
+def mirror_enabled():
+    # 🗄️ ใช้สำเนา Parquet ในเครื่อง (brush_store) เมื่อดึงจาก Google Sheet จริง
+    return ingest_backend() != "local" and str(_setting("use_mirror", "true")).lower() not in ("0", "false", "no")
+
+
+def load_workbook_data(sheet_id=SHEET_ID):
+    saved = saved_workbook(sheet_id)
+    if saved is not None:
+        return saved  # revision ที่เพิ่งบันทึกจากหน้า 2 (ไม่ต้องดาวน์โหลดใหม่)
+    if mirror_enabled():
+        from brush_store import load_mirrored_workbook  # import ตรงนี้เพื่อเลี่ยง circular import
+        return load_mirrored_workbook(sheet_id)
+    return fetch_workbook_data(sheet_id)
+
+
+def load_rounds(sheet_id=SHEET_ID):
+    # คืน {ชื่อชีต: InspectionRound} ของทุกชีตใน revision ปัจจุบัน ใช้ร่วมกันทุกหน้า
+    return load_workbook_data(sheet_id).rounds
+
+
+@st.cache_data(max_entries=16, show_spinner=False)
+def _read_round(sheet_id, revision, title, layout):
+    sh = get_spreadsheet(sheet_id)
+    return read_round(get_worksheet_index(sheet_id).worksheet(sh, title), layout)
+
+
+def load_round_values(sheet_id, title):
+    # รอบเดียวตามที่แสดงในชีต (วันที่เป็น DD/MM/YYYY) ใช้ในหน้ากรอกข้อมูล
+    # อ่าน 1 ครั้งต่อ revision แทน get_all_values + acell ทุกครั้งที่ rerun
+    return _read_round(sheet_id, get_revision(sheet_id), title, get_layout(sheet_id))
+
+
+# ------------------ อัปเดตทีละรอบหลังบันทึกจากหน้า 2 ------------------
+
+# ใช้ข้อมูลที่ patch หลังบันทึกได้นานเท่านี้ (วินาที) แล้วกลับไปอ่านไฟล์จริง
+# (ถ้ามีคนแก้ชีตพร้อมกันใน revision เดียวกัน ค่าที่แก้จะกลับมาหลังจากนี้)
+SAVED_WORKBOOK_TTL = 300
+
+
+@st.cache_resource(show_spinner=False)
+def _saved_workbooks():
+    # {sheet_id: (revision, layout, WorkbookData, เวลาที่บันทึก)} ข้อมูลหลังบันทึกล่าสุดของแต่ละเครื่อง ใช้ร่วมกันทุก session
+    # อยู่ในหน่วยความจำเท่านั้น: mirror ไม่ sync จากข้อมูลนี้ และ SQLite ไม่บันทึก revision ของมัน
+    return {}
+
+
+def saved_workbook(sheet_id=SHEET_ID):
+    # WorkbookData ที่ patch ไว้ของ revision + layout ปัจจุบัน (None = ไม่มี / revision ขยับแล้ว / หมดอายุ)
+    saved = _saved_workbooks().get(sheet_id)
+    if saved is None or time.monotonic() - saved[3] > SAVED_WORKBOOK_TTL:
+        return None
+    if saved[:2] != (get_revision(sheet_id), get_layout(sheet_id)):
+        return None
+    return saved[2]
+
+
+def _remember_saved(sheet_id, base_revision, workbook):
+    # ⚡ workbook (แก้แล้ว) เป็นข้อมูลของ revision หลังบันทึก (revision ไม่ขยับ → โหลดใหม่ตามปกติ)
+    revision = get_revision(sheet_id)
+    if revision != base_revision:
+        _saved_workbooks()[sheet_id] = (revision, get_layout(sheet_id), workbook, time.monotonic())
+
+
+def _carry_previous(previous, old_current, new_current):
+    # previous ของรอบถัดไปเป็นสูตร =SheetN!C3 → แปรงที่ค่าเท่ากับ current เดิมถือว่าลิงก์อยู่
+    # (สูตรที่อ้างถึงช่องว่างจะได้ 0)
+    with np.errstate(invalid="ignore"):
+        linked = (previous == old_current) | (np.isnan(old_current) & ((previous == 0) | np.isnan(previous)))
+    return np.where(linked, new_current, previous)
+
+
+def replace_round(workbook, rnd):
+    # 🧩 แทนรอบเดียว แล้วส่ง current ใหม่ต่อให้ previous ของรอบถัดไป (SheetN+1) ส่วนรอบอื่นใช้ของเดิม
+    old = workbook.rounds[rnd.name]
+    rounds = dict(workbook.rounds)
+    rounds[rnd.name] = rnd
+    number = sheet_number(rnd.name)
+    following = rounds.get(f"Sheet{number + 1}") if number is not None else None
+    if following is not None:
+        rounds[following.name] = replace(
+            following,
+            lower_previous=_carry_previous(following.lower_previous, old.lower_current, rnd.lower_current),
+            upper_previous=_carry_previous(following.upper_previous, old.upper_current, rnd.upper_current))
+    return WorkbookData(sheet_names=list(workbook.sheet_names), rounds=rounds, config_cells=dict(workbook.config_cells))
+
+
+def record_saved_round(sheet_id, base_revision, workbook, name, hours, prev_date, curr_date,
+                       lower_current, upper_current):
+    # 📤 เรียกหลังเขียนรอบ name ลงชีตแล้ว (base_revision / workbook = ที่อ่านไว้ก่อนเริ่มเขียน)
+    # revision ใหม่จะใช้ข้อมูลที่แก้ในหน่วยความจำชั่วคราว (SAVED_WORKBOOK_TTL) ระหว่างนั้น mirror ยังไม่ sync
+    # พอหมดอายุหรือ revision ขยับ mirror/SQLite จะ sync จากไฟล์จริง (เขียนใหม่เฉพาะรอบที่ fingerprint เปลี่ยน)
+    # กรณีอื่น (backend local, ยังไม่เคยโหลดรอบนี้, revision ไม่ขยับ) → โหลดใหม่ทั้งไฟล์แบบเดิม
+    invalidate_revision()
+    if ingest_backend() == "local" or name not in workbook.rounds:
+        return
+
+    layout = get_layout(sheet_id)
+    rnd = replace(
+        workbook.rounds[name],
+        hours=_to_hours(hours),
+        prev_date=_date_text(prev_date),
+        curr_date=_date_text(curr_date),
+        lower_current=np.asarray(lower_current, dtype=float)[:layout.brush_count],
+        upper_current=np.asarray(upper_current, dtype=float)[:layout.brush_count])
+    _remember_saved(sheet_id, base_revision, replace_round(workbook, rnd))
+
+
+# ------------------ ค่า config ใน Sheet1 (B41:B45, F40) ------------------
+
+@dataclass(frozen=True)
+class BrushConfig:
+    sheet_count: int = 7                # B41 จำนวนชีตที่ใช้คำนวณ (หน้า 1)
+    min_required: int = 5               # B42 จำนวนรอบขั้นต่ำที่ทำให้อัตราคงที่
+    threshold_percent: float = 5.0      # B43 เปอร์เซ็นต์ที่ยอมให้
+    alert_threshold_hours: int = 50     # B44 แจ้งเตือนเมื่อชั่วโมงเหลือน้อยกว่า
+    length_threshold: float = 35.0      # B45 ความยาวที่ต้องการให้แจ้งเตือน (mm)
+    sheet_save: int = 6                 # F40 จำนวนชีตที่ใช้ในหน้า 3
+
+
+def _config_value(value, kind, default):
+    try:
+        number = float(str(value).strip())
+    except (TypeError, ValueError):
+        return default
+    if np.isnan(number):
+        return default
+    return int(number) if kind is int else number
+
+
+def config_from_cells(config_cells, layout=DEFAULT_LAYOUT):
+    # ช่องไหนอ่านไม่ได้ใช้ค่า default ของช่องนั้น (ไม่ทิ้งทั้งชุด)
+    defaults = BrushConfig()
+    field_cells = layout.config_field_cells
+    values = {}
+    for f in fields(BrushConfig):
+        default = getattr(defaults, f.name)
+        values[f.name] = _config_value(config_cells.get(field_cells[f.name]), type(default), default)
+    return BrushConfig(**values)
+
+
+def load_config(sheet_id=SHEET_ID):
+    # มาจากการอ่านครั้งเดียวของ revision ปัจจุบัน (xlsx หรือ batchGet) ไม่ต้องเรียก acell ทีละช่อง
+    return config_from_cells(load_workbook_data(sheet_id).config_cells, get_layout(sheet_id))
+
+
+def save_config(sh, old_config, new_config, layout=DEFAULT_LAYOUT):
+    # 💾 เขียนเฉพาะช่องที่ค่าเปลี่ยน ด้วย batch update ครั้งเดียว
+    field_cells = layout.config_field_cells
+    changes = [
+        {"range": field_cells[f.name], "values": [[getattr(new_config, f.name)]]}
+        for f in fields(BrushConfig)
+        if getattr(new_config, f.name) != getattr(old_config, f.name)
+    ]
+    if not changes:
+        return False
+    patch = ingest_backend() != "local"
+    if patch:
+        # ข้อมูลก่อนเขียน (ปกติอยู่ใน cache แล้ว) → revision ใหม่ = ข้อมูลเดิม + config ที่เปลี่ยน ไม่ต้องดาวน์โหลดใหม่
+        base_revision = get_revision(sh.id)
+        workbook = load_workbook_data(sh.id)
+    sh.worksheet(layout.config_sheet).batch_update(changes)
+    invalidate_revision()
+    if patch:
+        config_cells = {**workbook.config_cells, **{c["range"]: c["values"][0][0] for c in changes}}
+        _remember_saved(sh.id, base_revision, replace(workbook, config_cells=config_cells))
+    return True
+
+
+# ------------------ ดัชนีรายชื่อชีต (worksheet metadata) ------------------
+
+def sheet_number(name):
+    # "Sheet12" → 12 / ชื่ออื่น → None
+    suffix = name.lower().replace("sheet", "").strip()
+    return int(suffix) if suffix.isdigit() else None
+
+
+def sheet1_first(titles, first=CONFIG_SHEET):
+    # ลำดับในไฟล์ แต่ให้ Sheet1 อยู่บนสุด
+    return [first] + [t for t in titles if t != first] if first in titles else list(titles)
+
+
+@dataclass(frozen=True)
+class WorksheetIndex:
+    titles: tuple            # ตามลำดับในไฟล์
+    properties: dict         # {title: properties ของ worksheet}
+    numbers: dict            # {title: เลข N ของ SheetN หรือ None}
+    ordered: tuple           # ชีต SheetN เรียงตามเลข (Sheet1 อยู่บนสุด)
+    last_round: str | None   # SheetN ที่เลขมากที่สุด (ไม่นับ Sheet1)
+    next_name: str           # ชื่อชีตถัดไปที่ว่าง เช่น Sheet13
+
+    @property
+    def ids(self):
+        return {title: props["sheetId"] for title, props in self.properties.items()}
+
+    @property
+    def sheet_titles(self):
+        return [t for t in self.titles if t.lower().startswith("sheet")]
+
+    @property
+    def sheet1_first(self):
+        return sheet1_first(self.titles)
+
+    def worksheet(self, sh, title):
+        # สร้าง Worksheet จาก metadata ที่มีอยู่แล้ว ไม่ต้องเรียก API เพิ่ม
+        return gspread.Worksheet(sh, dict(self.properties[title]), sh.id, sh.client)
+
+
+def build_worksheet_index(sheet_properties):
+    titles = tuple(props["title"] for props in sheet_properties)
+    numbers = {title: sheet_number(title) for title in titles}
+
+    ordered = sorted((t for t in titles if t.lower().startswith("sheet")),
+                     key=lambda t: numbers[t] if numbers[t] is not None else float("inf"))
+    if CONFIG_SHEET in ordered:
+        ordered.remove(CONFIG_SHEET)
+        ordered = [CONFIG_SHEET] + ordered
+
+    rounds = [t for t in titles if numbers[t] is not None and t.lower() != "sheet1" and t.lower().startswith("sheet")]
+    last_round = max(rounds, key=lambda t: numbers[t]) if rounds else None
+    next_name = f"Sheet{numbers[last_round] + 1}" if last_round else "Sheet2"
+
+    return WorksheetIndex(
+        titles=titles,
+        properties={props["title"]: props for props in sheet_properties},
+        numbers=numbers,
+        ordered=tuple(ordered),
+        last_round=last_round,
+        next_name=next_name,
+    )
+
+
+@st.cache_data(max_entries=8, show_spinner=False)
+def _worksheet_index(sheet_id, revision):
+    metadata = get_spreadsheet(sheet_id).fetch_sheet_metadata()
+    return build_worksheet_index([sheet["properties"] for sheet in metadata["sheets"]])
+
+
+def get_worksheet_index(sheet_id=SHEET_ID):
+    # 📑 เรียก metadata ครั้งเดียวต่อ revision (ชีตที่ถูกสร้าง/ลบ/เปลี่ยนชื่อจากที่อื่นทำให้ revision ขยับ)
+    # สร้าง/ย้ายชีตจากแอปเอง → invalidate_worksheet_index
+    return _worksheet_index(sheet_id, get_revision(sheet_id))
+
+
+def invalidate_worksheet_index():
+    _worksheet_index.clear()
@@ -0,0 +1,388 @@
+import hashlib
+import json
+import os
+import sqlite3
+import tempfile
+from contextlib import closing
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import streamlit as st
+
+from brush_sheet import (
+    SHEET_ID, InspectionRound, WorkbookData, _flight, _setting, fetch_workbook_data, get_layout, get_revision,
+    load_workbook_data, saved_workbook, sheet_number)
+
+
+# ------------------ สำเนา Parquet ของทุกรอบ (mirror) ------------------
+
+ROUND_COLUMNS = ("lower_previous", "lower_current", "upper_previous", "upper_current")
+
+
+def mirror_root():
+    return Path(_setting("mirror_dir", ".brush_mirror"))
+
+
+def round_fingerprint(rnd):
+    # ใช้ตรวจว่ารอบนี้ถูกแก้ไขหรือไม่ (Sheets API ไม่มีเวลาแก้ไขรายชีต)
+    h = hashlib.sha1()
+    h.update(json.dumps([rnd.name, rnd.hours, rnd.prev_date, rnd.curr_date]).encode())
+    for col in ROUND_COLUMNS:
+        h.update(np.ascontiguousarray(getattr(rnd, col), dtype=float).tobytes())
+    return h.hexdigest()
+
+
+def rounds_fingerprint(rounds, sheet_names):
+    # fingerprint รวมของหลายรอบตามลำดับ (รอบที่ไม่มีในไฟล์นับเป็นค่าว่าง)
+    h = hashlib.sha1()
+    for title in sheet_names:
+        h.update((round_fingerprint(rounds[title]) if title in rounds else "").encode())
+    return h.hexdigest()
+
+
+def _round_file_name(title):
+    return hashlib.sha1(title.encode()).hexdigest()[:16] + ".parquet"
+
+
+def _write_atomic(path, write):
+    # ไฟล์ชั่วคราวชื่อไม่ซ้ำในโฟลเดอร์เดียวกัน: หลาย session/thread sync รอบเดียวกันพร้อมกันได้
+    # (คนเขียนหลังสุดชนะ ไม่มีใครเห็นไฟล์ที่เขียนไม่เสร็จ)
+    with tempfile.NamedTemporaryFile(dir=path.parent, prefix=path.name + ".", suffix=".tmp", delete=False) as f:
+        tmp = Path(f.name)
+    try:
+        write(tmp)
+        os.replace(tmp, path)
+    except BaseException:
+        tmp.unlink(missing_ok=True)
+        raise
+
+
+class RoundMirror:
+    # 🗄️ เก็บแต่ละรอบเป็นไฟล์ Parquet 1 ไฟล์ + manifest.json (revision, layout, รายชื่อชีต, config, fingerprint)
+    def __init__(self, root):
+        self.root = Path(root)
+        self.rounds_dir = self.root / "rounds"
+        self.manifest_path = self.root / "manifest.json"
+        self.manifest = self._load_manifest()
+
+    def _load_manifest(self):
+        try:
+            return json.loads(self.manifest_path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return {"revision": None, "layout": None, "sheet_names": [], "config_cells": {}, "rounds": {}}
+
+    @property
+    def revision(self):
+        return self.manifest.get("revision")
+
+    @property
+    def layout(self):
+        return self.manifest.get("layout")
+
+    def sync(self, workbook, revision, layout_key):
+        # 🔄 เขียนเฉพาะรอบที่ใหม่หรือถูกแก้ไข และลบรอบที่ไม่มีแล้ว คืนรายชื่อรอบที่เขียนใหม่
+        self.rounds_dir.mkdir(parents=True, exist_ok=True)
+        old = self.manifest.get("rounds", {})
+        new = {}
+        written = []
+        for title in workbook.sheet_names:
+            rnd = workbook.rounds[title]
+            fingerprint = round_fingerprint(rnd)
+            entry = {"file": _round_file_name(title), "fingerprint": fingerprint}
+            if old.get(title) != entry or not (self.rounds_dir / entry["file"]).exists():
+                _write_atomic(self.rounds_dir / entry["file"], lambda path, rnd=rnd: pq.write_table(_round_table(rnd), path))
+                written.append(title)
+            new[title] = entry
+
+        for title, entry in old.items():
+            if title not in new:
+                (self.rounds_dir / entry["file"]).unlink(missing_ok=True)
+
+        self.manifest = {
+            "revision": revision,
+            "layout": layout_key,
+            "sheet_names": list(workbook.sheet_names),
+            "config_cells": {k: _json_value(v) for k, v in workbook.config_cells.items()},
+            "rounds": new,
+        }
+        _write_atomic(self.manifest_path, lambda path: path.write_text(json.dumps(self.manifest, ensure_ascii=False), encoding="utf-8"))
+        return written
+
+    def read(self):
+        # 📖 อ่านแบบ memory-map จากไฟล์ Parquet (ไม่ต้อง parse xlsx)
+        rounds = {}
+        for title in self.manifest["sheet_names"]:
+            table = pq.read_table(self.rounds_dir / self.manifest["rounds"][title]["file"], memory_map=True)
+            rounds[title] = _round_from_table(title, table)
+        return WorkbookData(
+            sheet_names=list(self.manifest["sheet_names"]),
+            rounds=rounds,
+            config_cells=dict(self.manifest["config_cells"]),
+        )
+
+
+def _json_value(value):
+    return value if value is None or isinstance(value, (int, float, str, bool)) else str(value)
+
+
+def _round_table(rnd):
+    meta = {"name": rnd.name, "hours": rnd.hours, "prev_date": rnd.prev_date, "curr_date": rnd.curr_date}
+    arrays = {"brush": pa.array(np.arange(1, len(rnd.lower_current) + 1, dtype=np.int32))}
+    arrays.update({col: pa.array(np.asarray(getattr(rnd, col), dtype=float)) for col in ROUND_COLUMNS})
+    return pa.table(arrays).replace_schema_metadata({"round": json.dumps(meta, ensure_ascii=False)})
+
+
+def _round_from_table(title, table):
+    meta = json.loads(table.schema.metadata[b"round"])
+    hours = meta["hours"]
+    return InspectionRound(
+        name=title,
+        hours=float(hours) if hours is not None else None,
+        prev_date=meta["prev_date"],
+        curr_date=meta["curr_date"],
+        **{col: table.column(col).to_numpy() for col in ROUND_COLUMNS},
+    )
+
+
+def sync_mirror(sheet_id=SHEET_ID, revision=None, layout=None):
+    # sync ใหม่เมื่อ revision หรือ layout ไม่ตรงกับที่เก็บไว้ (layout เปลี่ยน = ความยาว array เปลี่ยน)
+    revision = revision or get_revision(sheet_id)
+    layout = layout or get_layout(sheet_id)
+    mirror = RoundMirror(mirror_root() / sheet_id)
+    if (mirror.revision, mirror.layout) != (revision, layout.key):
+        mirror.sync(fetch_workbook_data(sheet_id), revision, layout.key)
+    return mirror
+
+
+@st.cache_data(max_entries=4, show_spinner=False)
+def _mirrored_workbook(sheet_id, revision, layout):
+    try:
+        workbook = sync_mirror(sheet_id, revision, layout).read()
+    except OSError:
+        # เขียนดิสก์ไม่ได้ → ใช้ข้อมูลจากต้นทางตรง ๆ
+        return fetch_workbook_data(sheet_id)
+    return workbook
+
+
+def load_mirrored_workbook(sheet_id=SHEET_ID):
+    return _mirrored_workbook(sheet_id, get_revision(sheet_id), get_layout(sheet_id))
+
+
+# ------------------ ประวัติการวัดใน SQLite ------------------
+
+HISTORY_SCHEMA = """
+CREATE TABLE IF NOT EXISTS units (
+    unit TEXT PRIMARY KEY,
+    revision TEXT,
+    layout TEXT                      -- BrushLayout.key ของข้อมูลที่ sync ไว้
+);
+CREATE TABLE IF NOT EXISTS rounds (
+    unit TEXT NOT NULL,
+    round TEXT NOT NULL,
+    seq INTEGER NOT NULL,            -- ลำดับรอบ (เรียงตามเลข SheetN)
+    hours REAL,
+    prev_date TEXT,
+    curr_date TEXT,
+    fingerprint TEXT,
+    PRIMARY KEY (unit, round)
+);
+CREATE TABLE IF NOT EXISTS measurements (
+    unit TEXT NOT NULL,
+    side TEXT NOT NULL,              -- 'upper' / 'lower'
+    brush INTEGER NOT NULL,
+    round TEXT NOT NULL,
+    previous REAL,
+    current REAL,
+    rate REAL,                       -- (previous - current) / hours ยังไม่ตัดค่าติดลบ
+    PRIMARY KEY (unit, side, brush, round)
+);
+CREATE TABLE IF NOT EXISTS stabilization_runs (
+    unit TEXT NOT NULL,
+    min_required INTEGER NOT NULL,
+    threshold REAL NOT NULL,
+    rounds TEXT NOT NULL,            -- รายชื่อรอบที่เลือก (JSON ตามลำดับ)
+    fingerprint TEXT NOT NULL,       -- ข้อมูลของรอบเหล่านั้นตอนคำนวณ
+    PRIMARY KEY (unit, min_required, threshold, rounds)
+);
+CREATE TABLE IF NOT EXISTS stabilized_rates (
+    unit TEXT NOT NULL,
+    min_required INTEGER NOT NULL,
+    threshold REAL NOT NULL,
+    rounds TEXT NOT NULL,
+    side TEXT NOT NULL,              -- 'upper' / 'lower'
+    brush INTEGER NOT NULL,
+    rate REAL NOT NULL,              -- Avg Rate ที่ใช้ (ปัด 6 ตำแหน่ง)
+    fixed_round TEXT,                -- คอลัมน์ที่ทำให้ rate คงที่ (ตัวอักษรสีเหลือง), NULL = ยังไม่คงที่
+    PRIMARY KEY (unit, min_required, threshold, rounds, side, brush)
+);
+CREATE INDEX IF NOT EXISTS idx_measurements_round ON measurements (unit, round);
+CREATE INDEX IF NOT EXISTS idx_rounds_seq ON rounds (unit, seq);
+
+CREATE VIEW IF NOT EXISTS rate_series AS
+SELECT m.unit, m.side, m.brush, r.seq, m.round, r.hours, m.rate
+FROM measurements m JOIN rounds r ON r.unit = m.unit AND r.round = m.round
+WHERE m.rate > 0;
+
+CREATE VIEW IF NOT EXISTS latest_current AS
+SELECT m.unit, m.side, m.brush, m.round, m.current
+FROM measurements m JOIN rounds r ON r.unit = m.unit AND r.round = m.round
+WHERE m.current IS NOT NULL
+  AND r.seq = (
+    SELECT MAX(r2.seq)
+    FROM measurements m2 JOIN rounds r2 ON r2.unit = m2.unit AND r2.round = m2.round
+    WHERE m2.unit = m.unit AND m2.side = m.side AND m2.brush = m.brush AND m2.current IS NOT NULL);
+"""
+
+SIDES = ("upper", "lower")
+
+
+def _sql_number(value):
+    return None if value is None or not np.isfinite(value) else float(value)
+
+
+def _round_order(sheet_names):
+    return sorted(sheet_names, key=lambda t: (sheet_number(t) if sheet_number(t) is not None else float("inf"),
+                                              sheet_names.index(t)))
+
+
+class HistoryStore:
+    # 🗃️ เก็บทุกการวัดและ rate รายรอบ ค้นหาด้วย index (unit, side, brush, round)
+    def __init__(self, path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._provisional = {}  # {unit: (revision, layout key)} ที่ sync จากข้อมูลที่ patch หลังบันทึก (ไม่ลง units)
+        with closing(self._connect()) as con:
+            con.executescript(HISTORY_SCHEMA)
+            # ไฟล์ที่สร้างก่อนมีคอลัมน์ layout
+            if "layout" not in [row[1] for row in con.execute("PRAGMA table_info(units)")]:
+                con.execute("ALTER TABLE units ADD COLUMN layout TEXT")
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    def synced(self, unit):
+        # (revision, layout key) ของข้อมูลที่ sync ไว้ล่าสุด
+        with closing(self._connect()) as con:
+            row = con.execute("SELECT revision, layout FROM units WHERE unit = ?", (unit,)).fetchone()
+        return tuple(row) if row else (None, None)
+
+    def sync(self, unit, workbook, revision, layout_key, provisional=False):
+        # 🔄 upsert เฉพาะรอบที่ fingerprint เปลี่ยน
+        # provisional = ข้อมูลที่ patch ในหน่วยความจำ: เขียนรอบที่เปลี่ยนแต่ไม่บันทึก revision
+        # → sync จากไฟล์จริงอีกครั้งเมื่อ patch หมดอายุ
+        synced = self._provisional.get(unit) if provisional else self.synced(unit)
+        if synced == (revision, layout_key):
+            return []
+        order = _round_order(list(workbook.sheet_names))
+        written = []
+        with closing(self._connect()) as con, con:
+            known = dict(con.execute("SELECT round, fingerprint FROM rounds WHERE unit = ?", (unit,)))
+            for seq, title in enumerate(order):
+                rnd = workbook.rounds[title]
+                fingerprint = round_fingerprint(rnd)
+                con.execute(
+                    "INSERT OR REPLACE INTO rounds VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (unit, title, seq, _sql_number(rnd.hours), rnd.prev_date, rnd.curr_date, fingerprint))
+                if known.get(title) == fingerprint:
+                    continue
+                con.execute("DELETE FROM measurements WHERE unit = ? AND round = ?", (unit, title))
+                con.executemany("INSERT INTO measurements VALUES (?, ?, ?, ?, ?, ?, ?)", _measurement_rows(unit, rnd))
+                written.append(title)
+            for title in set(known) - set(order):
+                con.execute("DELETE FROM measurements WHERE unit = ? AND round = ?", (unit, title))
+                con.execute("DELETE FROM rounds WHERE unit = ? AND round = ?", (unit, title))
+            if not provisional:
+                con.execute("INSERT OR REPLACE INTO units VALUES (?, ?, ?)", (unit, revision, layout_key))
+        if provisional:
+            self._provisional[unit] = (revision, layout_key)
+        else:
+            self._provisional.pop(unit, None)
+        return written
+
+    def query(self, sql, params=()):
+        with closing(self._connect()) as con:
+            return pd.read_sql_query(sql, con, params=params)
+
+    def round_frame(self, unit, round_name):
+        # ตาราง Previous/Current ของรอบเดียว (index = Brush No)
+        df = self.query(
+            "SELECT side, brush, previous, current FROM measurements WHERE unit = ? AND round = ? ORDER BY brush",
+            (unit, round_name))
+        wide = df.pivot(index="brush", columns="side", values=["previous", "current"])
+        wide.columns = [f"{side.capitalize()}_{kind.capitalize()}" for kind, side in wide.columns]
+        wide.index.name = "Brush No"
+        return wide.reindex(columns=["Lower_Previous", "Lower_Current", "Upper_Previous", "Upper_Current"])
+
+    def current_lengths(self, unit, round_name, brush_count):
+        # ความยาวปัจจุบันของรอบที่เลือก คืน (upper, lower) เป็น array ยาว brush_count
+        df = self.query(
+            "SELECT side, brush, current FROM measurements WHERE unit = ? AND round = ?", (unit, round_name))
+        out = {side: np.full(brush_count, np.nan) for side in SIDES}
+        for side, brush, current in df.itertuples(index=False):
+            if 1 <= brush <= brush_count and current is not None:
+                out[side][brush - 1] = current
+        return out["upper"], out["lower"]
+
+    def rate_series(self, unit, side, brush=None):
+        # 📈 rate ทุกรอบตลอดประวัติ (ใช้ดูแนวโน้มระยะยาว)
+        sql = "SELECT brush, seq, round, hours, rate FROM rate_series WHERE unit = ? AND side = ?"
+        params = [unit, side]
+        if brush is not None:
+            sql += " AND brush = ?"
+            params.append(int(brush))
+        return self.query(sql + " ORDER BY brush, seq", params)
+
+    def _stabilization_key(self, unit, min_required, threshold, rounds):
+        return unit, int(min_required), float(threshold), json.dumps(list(rounds), ensure_ascii=False)
+
+    def stabilized(self, unit, min_required, threshold, rounds, fingerprint):
+        # 🟩 ผล rate คงที่ที่เคยคำนวณไว้ของชุดรอบ + ค่าตั้งนี้ (None = ยังไม่เคยคำนวณ หรือข้อมูลรอบเปลี่ยนไปแล้ว)
+        key = self._stabilization_key(unit, min_required, threshold, rounds)
+        where = "unit = ? AND min_required = ? AND threshold = ? AND rounds = ?"
+        with closing(self._connect()) as con:
+            row = con.execute(f"SELECT fingerprint FROM stabilization_runs WHERE {where}", key).fetchone()
+            if row is None or row[0] != fingerprint:
+                return None
+            return pd.read_sql_query(
+                f"SELECT side, brush, rate, fixed_round FROM stabilized_rates WHERE {where} ORDER BY side, brush",
+                con, params=key)
+
+    def save_stabilized(self, unit, min_required, threshold, rounds, fingerprint, frame):
+        # frame = คอลัมน์ side, brush, rate, fixed_round (แทนผลเดิมของ key นี้ทั้งชุด)
+        key = self._stabilization_key(unit, min_required, threshold, rounds)
+        where = "unit = ? AND min_required = ? AND threshold = ? AND rounds = ?"
+        with closing(self._connect()) as con, con:
+            con.execute(f"DELETE FROM stabilized_rates WHERE {where}", key)
+            con.execute("INSERT OR REPLACE INTO stabilization_runs VALUES (?, ?, ?, ?, ?)", (*key, fingerprint))
+            con.executemany(
+                "INSERT INTO stabilized_rates VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                [(*key, side, int(brush), float(rate), fixed_round)
+                 for side, brush, rate, fixed_round in frame.itertuples(index=False)])
+
+
+def _measurement_rows(unit, rnd):
+    hours = rnd.hours if rnd.hours is not None and np.isfinite(rnd.hours) and rnd.hours > 0 else None
+    for side, previous, current in (("upper", rnd.upper_previous, rnd.upper_current),
+                                    ("lower", rnd.lower_previous, rnd.lower_current)):
+        for i, (p, c) in enumerate(zip(previous, current)):
+            rate = (p - c) / hours if hours and np.isfinite(p) and np.isfinite(c) else None
+            yield unit, side, i + 1, rnd.name, _sql_number(p), _sql_number(c), _sql_number(rate) if rate is not None else None
+
+
+@st.cache_resource(show_spinner=False)
+def get_history_store():
+    return HistoryStore(mirror_root() / "history.sqlite")
+
+
+def load_history(sheet_id=SHEET_ID):
+    # ทำให้ SQLite ตรงกับ revision + layout ปัจจุบันก่อนใช้ (sync เฉพาะรอบที่เปลี่ยน)
+    store = get_history_store()
+    revision, layout = get_revision(sheet_id), get_layout(sheet_id)
+    provisional = saved_workbook(sheet_id) is not None
+    if provisional or store.synced(sheet_id) != (revision, layout.key):
+        _flight.do(("history", sheet_id, revision, layout, provisional),
+                   lambda: store.sync(sheet_id, load_workbook_data(sheet_id), revision, layout.key, provisional))
+    return store
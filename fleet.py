@@ -0,0 +1,107 @@
+import json
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+from brush_calc import ESTIMATOR_LEAST_SQUARES, SIDES, evaluate_unit, operating_hours_per_day, round_lengths
+from brush_models import ESTIMATORS, history_rounds, unit_estimator
+from brush_sheet import (
+    SHEET_ID, _setting, config_from_cells, get_layout, get_revision, load_workbook_data, sheet1_first)
+
+
+# ------------------ ทะเบียนเครื่อง (1 เครื่อง = 1 Google Sheet) ------------------
+
+def fleet_units():
+    # 🏭 {ชื่อเครื่อง: sheet_id} จาก secrets / env "fleet_units" (ค่าเริ่มต้น = ชีตหลักของ dashboard)
+    units = _setting("fleet_units") or {"Unit 1": SHEET_ID}
+    if isinstance(units, str):
+        units = json.loads(units)
+    return {str(name): str(sheet_id) for name, sheet_id in dict(units).items()}
+
+
+# ------------------ pool สำหรับดึงข้อมูลและคำนวณ (thread) ------------------
+# งานคำนวณต่อเครื่องเป็น NumPy ระดับมิลลิวินาที จึงทำต่อใน thread เดียวกับที่ดึงข้อมูล
+# (ไม่ใช้ process pool: spawn ใน Streamlit จะ import Home.py ซ้ำในทุก process ลูกแล้วรันหน้า 1 ทั้งหน้า)
+
+FLEET_IO_WORKERS = 8
+
+
+@st.cache_resource(show_spinner=False)
+def get_io_pool():
+    return ThreadPoolExecutor(max_workers=int(_setting("fleet_io_workers", FLEET_IO_WORKERS)),
+                              thread_name_prefix="fleet-io")
+
+
+# ------------------ ประเมินแต่ละเครื่อง ------------------
+
+@st.cache_data(max_entries=256, show_spinner=False)
+def _unit_frame(name, sheet_id, revision, layout, estimator):
+    # 📊 ตารางผลของเครื่องเดียว (1 แถวต่อด้าน × แปรง) cache ตาม revision ของชีตนั้น
+    workbook = load_workbook_data(sheet_id)
+    config = config_from_cells(workbook.config_cells, layout)
+    selected = sheet1_first(workbook.sheet_names, layout.config_sheet)[:config.sheet_count]
+    fitted = history_rounds(workbook) if estimator == ESTIMATOR_LEAST_SQUARES else selected
+    names, hours, lengths = round_lengths(workbook.rounds, fitted, layout.brush_count)
+
+    current = np.full((len(SIDES), layout.brush_count), np.nan)
+    current_round = workbook.rounds.get(f"Sheet{config.sheet_count}")
+    if current_round is not None:
+        current[0] = current_round.upper_current
+        current[1] = current_round.lower_current
+
+    result = evaluate_unit(names, hours, lengths, current,
+                           config.min_required, config.threshold_percent / 100, config.length_threshold,
+                           current_round.curr_date if current_round is not None else None,
+                           operating_hours_per_day(workbook.rounds, selected), estimator)
+
+    brush = np.tile(np.arange(1, layout.brush_count + 1), len(SIDES))
+    return pd.DataFrame({
+        "Unit": name,
+        "Side": np.repeat(SIDES, layout.brush_count),
+        "Brush #": brush,
+        "Current (mm)": result.current.ravel(),
+        "Threshold (mm)": config.length_threshold,
+        "Margin (mm)": result.current.ravel() - config.length_threshold,
+        "Avg Rate": result.avg.ravel(),
+        "Rate Method": ESTIMATORS[estimator],
+        "Rate Fixed": result.fixed.ravel(),
+        "Remaining Hours": result.forecast.hours.ravel(),
+        "Projected Date": result.forecast.dates.ravel(),
+    })
+
+
+def _evaluate(name, sheet_id):
+    return _unit_frame(name, sheet_id, get_revision(sheet_id), get_layout(sheet_id), unit_estimator(sheet_id))
+
+
+@dataclass
+class FleetResult:
+    frame: pd.DataFrame          # ทุกแปรงของทุกเครื่อง
+    errors: dict                 # {ชื่อเครื่อง: ข้อความ error}
+
+    def closest(self, n):
+        # แปรงที่ความยาวเหลือใกล้ length_threshold ที่สุด (ไม่นับแปรงที่ไม่มีค่าปัจจุบัน)
+        if self.frame.empty:
+            return self.frame
+        frame = self.frame.dropna(subset=["Margin (mm)"])
+        return frame.sort_values(["Margin (mm)", "Remaining Hours"]).head(n).reset_index(drop=True)
+
+
+def evaluate_fleet(units):
+    # ⚡ ดึงและคำนวณทุกเครื่องพร้อมกันใน thread pool
+    pool = get_io_pool()
+    futures = {pool.submit(_evaluate, name, sheet_id): name for name, sheet_id in units.items()}
+    frames, errors = {}, {}
+    for future in as_completed(futures):
+        name = futures[future]
+        try:
+            frames[name] = future.result()
+        except Exception as e:
+            errors[name] = str(e)
+
+    ordered = [frames[name] for name in units if name in frames]
+    frame = pd.concat(ordered, ignore_index=True) if ordered else pd.DataFrame()
+    return FleetResult(frame=frame, errors=errors)
@@ -5,6 +5,7 @@ import plotly.graph_objects as go
 import matplotlib.pyplot as plt
 import gspread
 from google.oauth2.service_account import Credentials
+from brush_sheet import load_rounds, load_workbook_data
 
 permanent_fixed_upper = {}
 permanent_fixed_lower = {}
@@ -53,8 +54,7 @@ if page == "📊 หน้าแสดงผล rate และ ชั่วโ
     sheet_id = "1cZ93K_ndX-8V4xX5lD7crCIZFaiAO5UuMsBMfTVbg-E"
     sheet_url_export = f"https://docs.google.com/spreadsheets/d/{sheet_id}/export?format=xlsx"
 
-    response = requests.get(sheet_url_export)
-    xls = pd.ExcelFile(BytesIO(response.content), engine="openpyxl")
+    rounds = load_rounds(sheet_id)  # 📖 อ่านทุกชีตครั้งเดียวต่อ revision
 
 
 
@@ -67,32 +67,21 @@ if page == "📊 หน้าแสดงผล rate และ ชั่วโ
 
     # Step 1: Calculate rates per sheet
     for sheet in selected_sheets:
-        df_raw = xls.parse(sheet, header=None)
-        try:
-            hours = float(df_raw.iloc[0, 7])
-        except:
+        rnd = rounds.get(sheet)
+        if rnd is None or rnd.hours is None:
             continue
-        df = xls.parse(sheet, skiprows=2, header=None)
-
-        lower_df = df.iloc[:, 0:3]
-        lower_df.columns = ["No_Lower", "Lower_Previous", "Lower_Current"]
-        lower_df = lower_df.apply(pd.to_numeric, errors='coerce').dropna()
-
-        upper_df = df.iloc[:, 4:6]
-        upper_df.columns = ["Upper_Current", "Upper_Previous"]
-        upper_df = upper_df.apply(pd.to_numeric, errors='coerce').dropna()
-        upper_df["No_Upper"] = range(1, len(upper_df) + 1)
+        hours = rnd.hours
 
         for n in brush_numbers:
-            u_row = upper_df[upper_df["No_Upper"] == n]
-            if not u_row.empty:
-                diff = u_row.iloc[0]["Upper_Current"] - u_row.iloc[0]["Upper_Previous"]
+            u_prev, u_curr = rnd.upper_previous[n - 1], rnd.upper_current[n - 1]
+            if pd.notna(u_prev) and pd.notna(u_curr):
+                diff = u_prev - u_curr
                 rate = diff / hours if hours > 0 else 0
                 upper_rates[n][f"Upper_{sheet}"] = rate if rate > 0 else 0
 
-            l_row = lower_df[lower_df["No_Lower"] == n]
-            if not l_row.empty:
-                diff = l_row.iloc[0]["Lower_Previous"] - l_row.iloc[0]["Lower_Current"]
+            l_prev, l_curr = rnd.lower_previous[n - 1], rnd.lower_current[n - 1]
+            if pd.notna(l_prev) and pd.notna(l_curr):
+                diff = l_prev - l_curr
                 rate = diff / hours if hours > 0 else 0
                 lower_rates[n][f"Lower_{sheet}"] = rate if rate > 0 else 0
 
@@ -267,10 +256,9 @@ if page == "📊 หน้าแสดงผล rate และ ชั่วโ
     avg_rate_lower = lower_avg
     
 
-    if "Sheet7" in xls.sheet_names:
-            df_sheet7 = xls.parse("Sheet7", header=None)
-            upper_current = pd.to_numeric(df_sheet7.iloc[2:34, 5], errors='coerce').values
-            lower_current = pd.to_numeric(df_sheet7.iloc[2:34, 2], errors='coerce').values
+    if "Sheet7" in rounds:
+            upper_current = rounds["Sheet7"].upper_current
+            lower_current = rounds["Sheet7"].lower_current
 
     def calculate_hours_safe(current, rate):
             return [(c - 35) / r if pd.notna(c) and r and r > 0 and c > 35 else 0 for c, r in zip(current, rate)]
@@ -306,39 +294,27 @@ if page == "📊 หน้าแสดงผล rate และ ชั่วโ
     #sheet_count = st.number_input("📌 กรอกจำนวนชีตย้อนหลังที่ต้องใช้", min_value=1, max_value=len(sheet_names), value=6)
     try:
         
-        xls = pd.ExcelFile(sheet_url_export, engine='openpyxl')
         
         selected_sheet_names = sheet_names[:sheet_count]
         brush_numbers = list(range(1, 33))
         upper_rates, lower_rates = {n: {} for n in brush_numbers}, {n: {} for n in brush_numbers}
 
         for sheet in selected_sheet_names:
-            df_raw = xls.parse(sheet, header=None)
-            try:
-                hours = float(df_raw.iloc[0, 7])
-            except:
+            rnd = rounds.get(sheet)
+            if rnd is None or rnd.hours is None:
                 continue
-            df = xls.parse(sheet, skiprows=2, header=None)
-
-            lower_df = df.iloc[:, 0:3]
-            lower_df.columns = ["No_Lower", "Lower_Previous", "Lower_Current"]
-            lower_df = lower_df.dropna().apply(pd.to_numeric, errors='coerce')
-
-            upper_df = df.iloc[:, 4:6]
-            upper_df.columns = ["Upper_Current", "Upper_Previous"]
-            upper_df = upper_df.dropna().apply(pd.to_numeric, errors='coerce')
-            upper_df["No_Upper"] = range(1, len(upper_df) + 1)
+            hours = rnd.hours
 
             for n in brush_numbers:
-                u_row = upper_df[upper_df["No_Upper"] == n]
-                if not u_row.empty:
-                    diff = u_row.iloc[0]["Upper_Current"] - u_row.iloc[0]["Upper_Previous"]
+                u_prev, u_curr = rnd.upper_previous[n - 1], rnd.upper_current[n - 1]
+                if pd.notna(u_prev) and pd.notna(u_curr):
+                    diff = u_prev - u_curr
                     rate = diff / hours if hours > 0 else np.nan
                     upper_rates[n][f"Upper_{sheet}"] = rate if rate > 0 else np.nan
 
-                l_row = lower_df[lower_df["No_Lower"] == n]
-                if not l_row.empty:
-                    diff = l_row.iloc[0]["Lower_Previous"] - l_row.iloc[0]["Lower_Current"]
+                l_prev, l_curr = rnd.lower_previous[n - 1], rnd.lower_current[n - 1]
+                if pd.notna(l_prev) and pd.notna(l_curr):
+                    diff = l_prev - l_curr
                     rate = diff / hours if hours > 0 else np.nan
                     lower_rates[n][f"Lower_{sheet}"] = rate if rate > 0 else np.nan
 
@@ -350,9 +326,9 @@ if page == "📊 หน้าแสดงผล rate และ ชั่วโ
         avg_rate_upper = upper_avg
         avg_rate_lower = lower_avg
 
-        df_current = xls.parse(f"Sheet{sheet_count}", header=None, skiprows=2)
-        upper_current = pd.to_numeric(df_current.iloc[0:32, 5], errors='coerce').values
-        lower_current = pd.to_numeric(df_current.iloc[0:32, 2], errors='coerce').values
+        current_round = rounds[f"Sheet{sheet_count}"]
+        upper_current = current_round.upper_current
+        lower_current = current_round.lower_current
 
         def calculate_hours_safe(current, rate):
             return [(c - 35) / r if pd.notna(c) and r and r > 0 and c > 35 else 0 for c, r in zip(current, rate)]
@@ -769,45 +745,35 @@ elif page == "📈 พล็อตกราฟตามเวลา (แยก U
     # เชื่อมต่อ Google Sheet
     sheet_id = "1cZ93K_ndX-8V4xX5lD7crCIZFaiAO5UuMsBMfTVbg-E"
     sheet_url = f"https://docs.google.com/spreadsheets/d/{sheet_id}/export?format=xlsx"
-    xls = pd.ExcelFile(sheet_url)
+    workbook = load_workbook_data(sheet_id)
+    rounds = workbook.rounds
     
     
 
     sheet_count = st.number_input("📌 กรอกจำนวนชีตย้อนหลังที่ต้องใช้ (1-7)", min_value=1, max_value=7, value=6)
     # ดึงชื่อชีตจริงจากไฟล์
-    all_sheet_names = xls.sheet_names
+    all_sheet_names = workbook.sheet_names
     sheet_names = [s for s in all_sheet_names if s.lower().startswith("sheet")][:sheet_count]
 
     brush_numbers = list(range(1, 33))
     upper_rates, lower_rates = {n: {} for n in brush_numbers}, {n: {} for n in brush_numbers}
 
     for sheet in sheet_names:
-        df_raw = xls.parse(sheet, header=None)
-        try:
-            hours = float(df_raw.iloc[0, 7])
-        except:
+        rnd = rounds.get(sheet)
+        if rnd is None or rnd.hours is None:
             continue
-        df = xls.parse(sheet, skiprows=2, header=None)
-
-        lower_df = df.iloc[:, 0:3]
-        lower_df.columns = ["No_Lower", "Lower_Previous", "Lower_Current"]
-        lower_df = lower_df.dropna().apply(pd.to_numeric, errors='coerce')
-
-        upper_df = df.iloc[:, 4:6]
-        upper_df.columns = ["Upper_Current", "Upper_Previous"]
-        upper_df = upper_df.dropna().apply(pd.to_numeric, errors='coerce')
-        upper_df["No_Upper"] = range(1, len(upper_df) + 1)
+        hours = rnd.hours
 
         for n in brush_numbers:
-            u_row = upper_df[upper_df["No_Upper"] == n]
-            if not u_row.empty:
-                diff = u_row.iloc[0]["Upper_Current"] - u_row.iloc[0]["Upper_Previous"]
+            u_prev, u_curr = rnd.upper_previous[n - 1], rnd.upper_current[n - 1]
+            if pd.notna(u_prev) and pd.notna(u_curr):
+                diff = u_prev - u_curr
                 rate = diff / hours if hours > 0 else np.nan
                 upper_rates[n][f"Upper_{sheet}"] = rate if rate > 0 else np.nan
 
-            l_row = lower_df[lower_df["No_Lower"] == n]
-            if not l_row.empty:
-                diff = l_row.iloc[0]["Lower_Previous"] - l_row.iloc[0]["Lower_Current"]
+            l_prev, l_curr = rnd.lower_previous[n - 1], rnd.lower_current[n - 1]
+            if pd.notna(l_prev) and pd.notna(l_curr):
+                diff = l_prev - l_curr
                 rate = diff / hours if hours > 0 else np.nan
                 lower_rates[n][f"Lower_{sheet}"] = rate if rate > 0 else np.nan
 
@@ -860,9 +826,9 @@ elif page == "📈 พล็อตกราฟตามเวลา (แยก U
  
 
     # ใช้ current จาก sheet ล่าสุด เช่น Sheet{sheet_count}
-    df_current = xls.parse(f"Sheet{sheet_count}", header=None, skiprows=2)
-    upper_current = pd.to_numeric(df_current.iloc[0:32, 5], errors='coerce').values
-    lower_current = pd.to_numeric(df_current.iloc[0:32, 2], errors='coerce').values
+    current_round = rounds[f"Sheet{sheet_count}"]
+    upper_current = current_round.upper_current
+    lower_current = current_round.lower_current
 
     time_hours = np.arange(0, 201, 10)
 
@@ -0,0 +1,63 @@
+import numpy as np
+import pytest
+
+from brush_sheet import InspectionRound, WorkbookData
+from brush_store import HistoryStore
+
+
+def _round(name, hours, previous, current):
+    previous, current = np.asarray(previous, dtype=float), np.asarray(current, dtype=float)
+    return InspectionRound(name=name, hours=hours, prev_date="01/05/2025", curr_date="15/05/2025",
+                           lower_previous=previous - 1, lower_current=current - 1,
+                           upper_previous=previous, upper_current=current)
+
+
+def _workbook(*rounds):
+    return WorkbookData(sheet_names=["Sheet1", *[r.name for r in rounds]],
+                        rounds={"Sheet1": _round("Sheet1", None, [np.nan] * 3, [np.nan] * 3),
+                                **{r.name: r for r in rounds}},
+                        config_cells={})
+
+
+@pytest.fixture
+def store(tmp_path):
+    return HistoryStore(tmp_path / "history.sqlite")
+
+
+def test_sync_then_rate_series(store):
+    workbook = _workbook(_round("Sheet2", 100.0, [50, 50, 50], [49, 50, 48]),
+                         _round("Sheet3", 200.0, [49, 50, 48], [47, 51, np.nan]))
+    written = store.sync("u", workbook, "r1", "layout")
+
+    assert sorted(written) == ["Sheet1", "Sheet2", "Sheet3"]
+    assert store.synced("u") == ("r1", "layout")
+    series = store.rate_series("u", "upper")
+    # rate <= 0 (แปรง 2) และค่าที่ไม่มี current ไม่อยู่ใน view
+    assert series[["brush", "round"]].values.tolist() == [[1, "Sheet2"], [1, "Sheet3"], [3, "Sheet2"]]
+    assert series["rate"].tolist() == pytest.approx([0.01, 0.01, 0.02])
+    assert store.rate_series("u", "upper", brush=3)["round"].tolist() == ["Sheet2"]
+
+
+def test_sync_rewrites_only_changed_rounds(store):
+    first = _workbook(_round("Sheet2", 100.0, [50, 50, 50], [49, 50, 48]))
+    store.sync("u", first, "r1", "layout")
+    assert store.sync("u", first, "r1", "layout") == []
+
+    second = _workbook(_round("Sheet2", 100.0, [50, 50, 50], [45, 50, 48]))
+    assert store.sync("u", second, "r2", "layout") == ["Sheet2"]
+    assert store.rate_series("u", "upper", brush=1)["rate"].tolist() == pytest.approx([0.05])
+
+
+def test_provisional_sync_keeps_revision(store):
+    store.sync("u", _workbook(_round("Sheet2", 100.0, [50, 50, 50], [49, 50, 48])), "r1", "layout")
+    patched = _workbook(_round("Sheet2", 100.0, [50, 50, 50], [40, 50, 48]))
+
+    assert store.sync("u", patched, "r2", "layout", provisional=True) == ["Sheet2"]
+    assert store.synced("u") == ("r1", "layout")      # ยังต้อง sync จากไฟล์จริงอีกครั้ง
+    assert store.sync("u", patched, "r2", "layout", provisional=True) == []
+    assert store.rate_series("u", "upper", brush=1)["rate"].tolist() == pytest.approx([0.1])
+
+    real = _workbook(_round("Sheet2", 100.0, [50, 50, 50], [42, 50, 48]))
+    assert store.sync("u", real, "r2", "layout") == ["Sheet2"]
+    assert store.synced("u") == ("r2", "layout")
+    assert store.rate_series("u", "upper", brush=1)["rate"].tolist() == pytest.approx([0.08])